@@ -7,14 +7,10 @@ import time
 from datetime import datetime
 from typing import List, Dict, Any
 import argparse
+from types import MappingProxyType
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from src.utils.ollama_utils import get_model_size_in_billions, get_local_ollama_models
-from core.enhanced_tuner import EnhancedOllamaTuner
-from utils.memory_monitor import get_memory_monitor
-from utils.cache_manager import get_cache_manager
-
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -27,44 +23,54 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+# 依模型大小選用的約束條件；以唯讀 mapping 保存，回傳時再複製一份供呼叫端修改
+SMALL_MODEL_CONSTRAINTS = MappingProxyType({
+    "time_limit_s": 30.0,
+    "ttft_limit_s": 2.0,
+    "hallucination_threshold": 0.95,
+    "num_predict": 1024
+})
+MEDIUM_MODEL_CONSTRAINTS = MappingProxyType({
+    "time_limit_s": 120.0,
+    "ttft_limit_s": 6.0,
+    "hallucination_threshold": 1.0,
+    "num_predict": 2048
+})
+LARGE_MODEL_CONSTRAINTS = MappingProxyType({
+    "time_limit_s": 180.0,
+    "ttft_limit_s": 15.0,
+    "hallucination_threshold": 0.95,
+    "num_predict": 8192
+})
+DEFAULT_MODEL_CONSTRAINTS = MappingProxyType({
+    "time_limit_s": 60.0,
+    "ttft_limit_s": 5.0,
+    "hallucination_threshold": 0.95,
+    "num_predict": 256
+})
+
 def select_constraints_by_size(model_data: Dict) -> Dict:
+    from src.utils.ollama_utils import get_model_size_in_billions
+
     model_name = model_data.get('name') or model_data.get('model')
     size_b = get_model_size_in_billions(model_data.get('details', {}))
     
     logger.info(f"偵測到模型 '{model_name}' 的大小約為 {size_b:.2f}B")
     
     if 0 < size_b < 10:
-        return {
-            "time_limit_s": 30.0,
-            "ttft_limit_s": 2.0,
-            "hallucination_threshold": 0.95,
-            "num_predict": 1024
-        }
+        return dict(SMALL_MODEL_CONSTRAINTS)
     elif 10 <= size_b <= 18:
-        return {
-            "time_limit_s": 120.0,
-            "ttft_limit_s": 6.0,
-            "hallucination_threshold": 1.0,
-            "num_predict": 2048
-        }
+        return dict(MEDIUM_MODEL_CONSTRAINTS)
     elif size_b > 18:
-        return {
-            "time_limit_s": 180.0,
-            "ttft_limit_s": 15.0,
-            "hallucination_threshold": 0.95,
-            "num_predict": 8192
-        }
+        return dict(LARGE_MODEL_CONSTRAINTS)
     else:
         logger.warning("使用通用預設約束條件")
-        return {
-            "time_limit_s": 60.0,
-            "ttft_limit_s": 5.0,
-            "hallucination_threshold": 0.95,
-            "num_predict": 256
-        }
+        return dict(DEFAULT_MODEL_CONSTRAINTS)
 
 def generate_enhanced_html_report(results_data: List[Dict]):
-    from jinja2 import Environment, FileSystemLoader
+    from utils.report_utils import get_report_template
+    from src.utils.memory_monitor import get_memory_monitor
+    from src.utils.cache_manager import get_cache_manager
     
     report_filename = 'enhanced_ollama_tuner_report.html'
     
@@ -73,8 +79,7 @@ def generate_enhanced_html_report(results_data: List[Dict]):
             os.remove(report_filename)
             logger.info(f"已刪除舊的報告檔案：{report_filename}")
         
-        env = Environment(loader=FileSystemLoader('.'))
-        template = env.get_template('enhanced_report_template.html')
+        template = get_report_template()
         
         report_data = {
             'results': results_data,
@@ -83,10 +88,8 @@ def generate_enhanced_html_report(results_data: List[Dict]):
             'cache_stats': get_cache_manager().get_cache_stats()
         }
         
-        html_content = template.render(report_data)
-        
         with open(report_filename, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+            template.stream(report_data).dump(f)
         
         logger.info(f"增強的 HTML 報告已生成：{report_filename}")
         
@@ -151,12 +154,24 @@ def main():
     parser.add_argument("--time-limit", type=float, help="自定義測試的時間限制（秒）。")
     parser.add_argument("--ttft-limit", type=float, help="自定義 TTFT 的限制（秒）。")
     parser.add_argument("--verbose", action="store_true", help="啟用詳細日誌輸出 (DEBUG level)。")
+    parser.add_argument("--no-cache", action="store_true", help="忽略緩存結果，重新執行所有測試（適合乾淨的基準測試）。")
+    parser.add_argument("--eval-parallelism", type=int, help="品質評估時同時送出的 Ollama 請求數。")
+    parser.add_argument("--bayes-batch-size", type=int, help="貝葉斯優化每批同時評估的參數組合數（預設 4）。")
+    parser.add_argument("--bayes-batch-strategy", choices=["kb", "cl_min"],
+                        help="批次建議的假想觀測策略：kb 使用 GP 預測均值，cl_min 使用最差觀測值使批次更分散（預設 kb）。")
     args = parser.parse_args()
 
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
         logger.info("已啟用詳細日誌輸出 (DEBUG level)。")
 
+    # 延遲載入較重的模組（scikit-learn、scipy、ollama 等），讓 --help 等操作能立即返回
+    from src.utils.ollama_utils import get_local_ollama_models
+    from core.enhanced_tuner import EnhancedOllamaTuner
+    # 與 EnhancedOllamaTuner 使用同一個模組路徑，才會共用同一個監控器與其使用者計數
+    from src.utils.memory_monitor import get_memory_monitor
+    from src.utils.cache_manager import get_cache_manager
+
     print("🚀 增強的 Ollama Auto-Tuner")
     print("=" * 50)
     print("新功能:")
@@ -191,7 +206,7 @@ def main():
     memory_monitor = get_memory_monitor()
     cache_manager = get_cache_manager()
     
-    memory_monitor.start_monitoring(interval=1.0)
+    memory_monitor.acquire(interval=1.0, max_interval=30.0)
     
     all_results = []
     start_time = time.time()
@@ -212,9 +227,18 @@ def main():
             if args.ttft_limit:
                 constraints['ttft_limit_s'] = args.ttft_limit
                 logger.info(f"使用自定義 TTFT 限制: {args.ttft_limit}s")
+            if args.eval_parallelism:
+                constraints['eval_parallelism'] = args.eval_parallelism
+                logger.info(f"使用自定義評估並行數: {args.eval_parallelism}")
+            if args.bayes_batch_size:
+                constraints['bayes_batch_size'] = args.bayes_batch_size
+                logger.info(f"使用自定義貝葉斯批次大小: {args.bayes_batch_size}")
+            if args.bayes_batch_strategy:
+                constraints['bayes_batch_strategy'] = args.bayes_batch_strategy
+                logger.info(f"使用自定義貝葉斯批次策略: {args.bayes_batch_strategy}")
 
             logger.info(f"使用約束條件: {constraints}")           
-            tuner = EnhancedOllamaTuner(model_name=model_name, constraints=constraints)            
+            tuner = EnhancedOllamaTuner(model_name=model_name, constraints=constraints, use_cache=not args.no_cache)            
             result = tuner.run()
             
             if result and result != "incompatible":
@@ -248,7 +272,7 @@ def main():
     except Exception as e:
         logger.error(f"執行過程中發生錯誤: {e}", exc_info=args.verbose)
     finally:
-        memory_monitor.stop_monitoring()
+        memory_monitor.release()
         logger.info("程式執行完成")
 
 if __name__ == "__main__":
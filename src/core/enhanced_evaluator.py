@@ -4,9 +4,16 @@ import re
 import time
 from typing import Dict, List, Any, Tuple, Optional
 import logging
-from difflib import SequenceMatcher
 import json
 
+SENTENCE_SPLIT_PATTERN = re.compile(r'[。！？.!?]')
+CJK_CHAR_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+CJK_NAME_PATTERN = re.compile(r'[\u4e00-\u9fff]{2,4}')
+LATIN_CHAR_PATTERN = re.compile(r'[a-zA-Z]')
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+NUMBER_PATTERN = re.compile(r'\d+')
+PROPER_NOUN_PATTERN = re.compile(r'[A-Z][a-z]+')
+
 class EnhancedEvaluator:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
@@ -88,7 +95,7 @@ class EnhancedEvaluator:
         
         for pos, neg in contradictions:
             if pos in answer_lower and neg in answer_lower:
-                sentences = re.split(r'[。！？.!?]', answer)
+                sentences = SENTENCE_SPLIT_PATTERN.split(answer)
                 for sentence in sentences:
                     if pos in sentence.lower() and neg in sentence.lower():
                         contradiction_count += 1
@@ -169,7 +176,7 @@ class EnhancedEvaluator:
             多語言支援評分 (0-1)
         """
         if target_language == "zh":
-            chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', answer))
+            chinese_chars = len(CJK_CHAR_PATTERN.findall(answer))
             total_chars = len(answer.strip())
             
             if total_chars == 0:
@@ -179,7 +186,7 @@ class EnhancedEvaluator:
             return min(chinese_ratio * 1.5, 1.0)
         
         elif target_language == "en":
-            english_chars = len(re.findall(r'[a-zA-Z]', answer))
+            english_chars = len(LATIN_CHAR_PATTERN.findall(answer))
             total_chars = len(answer.strip())
             
             if total_chars == 0:
@@ -226,7 +233,7 @@ class EnhancedEvaluator:
         Returns:
             流暢度評分 (0-1)
         """
-        sentences = re.split(r'[。！？.!?]', answer)
+        sentences = SENTENCE_SPLIT_PATTERN.split(answer)
         if not sentences:
             return 0.0        
         avg_sentence_length = sum(len(s.strip()) for s in sentences) / len(sentences)
@@ -292,7 +299,7 @@ class EnhancedEvaluator:
     
     def _extract_keywords(self, text: str) -> List[str]:
         """提取關鍵詞"""
-        text = re.sub(r'[^\w\s]', '', text)
+        text = PUNCTUATION_PATTERN.sub('', text)
         words = text.split()
         stop_words = {'的', '是', '在', '有', '和', '與', '或', '但', '而', 'the', 'is', 'are', 'in', 'on', 'at', 'and', 'or', 'but'}
         keywords = [word for word in words if len(word) > 1 and word.lower() not in stop_words]
@@ -302,11 +309,11 @@ class EnhancedEvaluator:
     def _extract_facts_from_context(self, context: str) -> List[str]:
         """從上下文中提取事實"""
         facts = []
-        numbers = re.findall(r'\d+', context)
+        numbers = NUMBER_PATTERN.findall(context)
         facts.extend(numbers)
-        names = re.findall(r'[A-Z][a-z]+', context)
+        names = PROPER_NOUN_PATTERN.findall(context)
         facts.extend(names)
-        chinese_names = re.findall(r'[\u4e00-\u9fff]{2,4}', context)
+        chinese_names = CJK_NAME_PATTERN.findall(context)
         facts.extend(chinese_names)
         return facts[:10]
 
@@ -2,29 +2,50 @@
 # -*- coding: utf-8 -*-
 import ollama
 import time
-import multiprocessing
-import sys
 import os
 import logging
 import threading
-from typing import Dict, List, Any, Optional, Tuple
-from queue import Empty
+import pickle
+import re
+import tempfile
+from typing import Dict, List, Any, Optional, Tuple, Mapping
+from collections import deque, ChainMap
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
 
 from src.utils.memory_monitor import get_memory_monitor
-from src.utils.cache_manager import get_cache_manager
-from src.models.bayesian_optimizer import create_optimizer_for_quality_tuning, AdaptiveBayesianOptimizer
+from src.utils.cache_manager import get_cache_manager, get_answer_cache_manager, make_cache_key
+from src.utils.ollama_utils import get_ollama_client
+from src.models.bayesian_optimizer import create_optimizer_for_quality_tuning, create_pruner_for_quality_tuning, AdaptiveBayesianOptimizer
 from src.core.new_enhanced_evaluator import get_enhanced_evaluator, NEW_EVAL_LIBS_AVAILABLE
 from evaluation_dataset import HALLUCINATION_EVAL_SET, SUMMARIZATION_EVAL_SET, LONG_CONTEXT_PERFORMANCE_PROMPT
 
-# 嘗試從 human_eval 匯入，如果失敗也沒關係，後續有邏輯處理
-try:
-    from human_eval.data import read_problems
-    HUMAN_EVAL_AVAILABLE = NEW_EVAL_LIBS_AVAILABLE
-except ImportError:
-    HUMAN_EVAL_AVAILABLE = False
+# human_eval 只在實際評估程式碼題目時才匯入，如果不可用也沒關係，後續有邏輯處理
+HUMAN_EVAL_AVAILABLE = NEW_EVAL_LIBS_AVAILABLE
+
+# 長時間速度測試期間放慢記憶體/GPU 輪詢，避免監控執行緒干擾 TTFT 量測
+GPU_POLL_INTERVAL_SECONDS = float(os.environ.get("GPU_POLL_INTERVAL_SECONDS", "5"))
+
+# 優化器狀態檔的格式與評分尺度版本；評分方式改變時遞增，舊狀態檔的觀測就不會混入 GP
+OPTIMIZER_STATE_VERSION = 2
+# 調校期間讓 Ollama 保持模型常駐，避免兩次探測之間模型被卸載而重新載入
+MODEL_KEEP_ALIVE = os.environ.get("OLLAMA_TUNER_KEEP_ALIVE", "30m")
+# Ollama 認得的模型參數；best_settings 中的評分、詳細評估等其他欄位不會送出
+# （新版 ollama 的 Options 為 pydantic 模型，舊版為 TypedDict）
+OLLAMA_OPTION_KEYS = frozenset(getattr(ollama.Options, 'model_fields', None) or ollama.Options.__annotations__)
+
+def get_default_eval_workers() -> int:
+    """
+    Returns:
+        品質評估的預設並行請求數，與 Ollama 伺服器的 OLLAMA_NUM_PARALLEL 設定一致（未設定時為 2）
+    """
+    try:
+        return max(1, int(os.environ.get("OLLAMA_NUM_PARALLEL", "2")))
+    except ValueError:
+        return 2
 
 class EnhancedOllamaTuner:  
-    def __init__(self, model_name: str, constraints: Optional[Dict] = None, stop_event: Optional[threading.Event] = None):
+    def __init__(self, model_name: str, constraints: Optional[Dict] = None, stop_event: Optional[threading.Event] = None,
+                 use_cache: bool = True, eval_workers: Optional[int] = None, batch_size: int = 4):
         self.model_name = model_name
         self.constraints = constraints or {
             "time_limit_s": 60.0,
@@ -33,69 +54,241 @@ class EnhancedOllamaTuner:
             "num_predict": 256
         }
         self.stop_event = stop_event
+        self.use_cache = use_cache
+        self.eval_workers = self.constraints.get('eval_parallelism', eval_workers or get_default_eval_workers())
+        self.batch_size = self.constraints.get('bayes_batch_size', batch_size)
+        self.batch_strategy = self.constraints.get('bayes_batch_strategy', 'kb')
         self.memory_monitor = get_memory_monitor()
         self.cache_manager = get_cache_manager()
+        self.answer_cache_manager = get_answer_cache_manager()
         self.evaluator = get_enhanced_evaluator()
+        self.client = get_ollama_client()
         self.optimizer = create_optimizer_for_quality_tuning()
+        self.pruner = create_pruner_for_quality_tuning()
         self.best_settings = {}
-        self.current_process = None
+        self._model_info = None
+        # 本次執行中完整評估過的品質結果（不受 --no-cache 影響），供最後產生詳細評估時重用
+        self._quality_results = {}
+        # 同一批次中並行評估的所有設定共用這個執行緒池，同時送出的生成請求總數不超過 eval_workers
+        self._eval_executor = ThreadPoolExecutor(max_workers=self.eval_workers, thread_name_prefix='eval')
         self.logger = logging.getLogger(__name__)
-        self.memory_monitor.start_monitoring(interval=2.0)
+        safe_model_name = re.sub(r'[^\w.-]', '_', model_name)
+        self.state_path = os.path.join(self.cache_manager.cache_dir, "optimizer", f"{safe_model_name}.pkl")
+        # 狀態檔中最早一筆觀測的建立時間；與結果緩存相同，超過 max_age_hours 後整份狀態失效
+        self._state_created_at = time.time()
+        if self.use_cache:
+            self._load_persistent_state()
+        self.memory_monitor.acquire(interval=2.0, max_interval=30.0)
         
         self.logger.info(f"增強調校器已初始化: {model_name}")
     
-    def _safe_generate(self, prompt: str, settings: Dict, timeout: float) -> Tuple[Any, str]:
+    def _safe_generate(self, prompt: str, settings: Mapping, timeout: float, streaming: bool = False,
+                       max_duration: Optional[float] = None, max_ttft: Optional[float] = None) -> Tuple[Any, str]:
+        """
+        Args:
+            prompt: 提示詞
+            settings: 模型參數
+            timeout: 逾時秒數（套用於 HTTP 連線與讀取，避免卡住的模型無限期阻塞調校）
+            streaming: True 時以串流量測 (TTFT, TPS, 總耗時)，否則返回完整回答
+            max_duration: 串流超過此秒數即中止
+            max_ttft: 首個 token 超過此秒數即中止
+
+        Returns:
+            (結果, 狀態字串)
+        """
         try:
-            clean_settings = {}
-            for key, value in settings.items():
-                if key not in ['stream'] and isinstance(value, (int, float, str, bool)):
-                    clean_settings[key] = value
-            if settings.get('stream', False):
-                start_time = time.time()
-                stream = ollama.generate(model=self.model_name, prompt=prompt, options=clean_settings, stream=True)
-                first_token_time = None
-                token_count = 0
-                
-                for chunk in stream:
-                    if first_token_time is None:
-                        first_token_time = time.time()
-                    token_count += 1
-                
-                end_time = time.time()
-                if first_token_time is None:
-                    result = (float('inf'), 0, float('inf'))
-                else:
-                    ttft = first_token_time - start_time
-                    total_duration = end_time - start_time
-                    tps = (token_count - 1) / (total_duration - ttft) if (total_duration - ttft) > 0 else 0
-                    result = (ttft, tps, total_duration)
-                return result, "success"
-            else:
-                response = ollama.generate(model=self.model_name, prompt=prompt, options=clean_settings, stream=False)
-                return response['response'], "success"
-                
+            clean_settings = {key: value for key, value in settings.items() if key in OLLAMA_OPTION_KEYS}
+            client = get_ollama_client(timeout)
+            if streaming:
+                return self._stream_generate(client, prompt, clean_settings, max_duration, max_ttft), "success"
+            return self._oneshot_generate(client, prompt, clean_settings), "success"
         except Exception as e:
             return None, str(e)
     
+    def _oneshot_generate(self, client: ollama.Client, prompt: str, options: Dict) -> str:
+        response = client.generate(model=self.model_name, prompt=prompt, options=options,
+                                   stream=False, keep_alive=MODEL_KEEP_ALIVE)
+        return response['response']
+    
+    def _stream_generate(self, client: ollama.Client, prompt: str, options: Dict, max_duration: Optional[float],
+                         max_ttft: Optional[float]) -> Tuple[float, float, float]:
+        start_time = time.perf_counter()
+        stream = client.generate(model=self.model_name, prompt=prompt, options=options,
+                                 stream=True, keep_alive=MODEL_KEEP_ALIVE)
+        chunks = iter(stream)
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            return float('inf'), 0, float('inf')
+        
+        ttft = time.perf_counter() - start_time
+        if max_ttft is not None and ttft > max_ttft:
+            # TTFT 已超過限制，此設定必定失敗，不必等待完整生成
+            stream.close()
+            return ttft, 0, float('inf')
+        
+        final_chunk = first_chunk
+        if not first_chunk.get('done'):
+            if max_duration is None:
+                # 不需檢查時限時直接在 C 層耗盡串流，只保留最後一個 chunk
+                remaining = deque(chunks, maxlen=1)
+                if remaining:
+                    final_chunk = remaining[0]
+            else:
+                deadline = start_time + max_duration
+                for final_chunk in chunks:
+                    if final_chunk.get('done'):
+                        break
+                    if time.perf_counter() > deadline:
+                        # 已不可能滿足時間限制，提前中止生成以節省測試時間
+                        stream.close()
+                        return ttft, 0, float('inf')
+        
+        total_duration = time.perf_counter() - start_time
+        # 使用 Ollama 回報的 eval_count / eval_duration 計算 TPS，避免逐 token 計數的 Python 開銷
+        eval_count = final_chunk.get('eval_count') or 0
+        eval_duration = final_chunk.get('eval_duration') or 0
+        if eval_count < 2:
+            # 只生成一個 token 時無法得出有意義的生成速度
+            tps = 0
+        elif eval_duration > 0:
+            tps = eval_count / eval_duration * 1e9
+        else:
+            tps = (eval_count - 1) / (total_duration - ttft) if total_duration > ttft else 0
+        return ttft, tps, total_duration
+    
+    def _load_persistent_state(self):
+        """
+        載入先前執行保存的優化器觀測結果，讓貝葉斯優化從暖啟動開始。
+        """
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'rb') as f:
+                state = pickle.load(f)
+            if state.get('version') != OPTIMIZER_STATE_VERSION:
+                self.logger.info(f"優化器狀態 {self.state_path} 的評分版本不符，將從頭開始")
+                return
+            created_at = state.get('created_at', 0.0)
+            if time.time() - created_at >= self.cache_manager.max_age_hours * 3600:
+                self.logger.info(f"優化器狀態 {self.state_path} 已超過 {self.cache_manager.max_age_hours} 小時，將從頭開始")
+                return
+            self._state_created_at = created_at
+            added = self.optimizer.seed(state.get('observations', []))
+            self.logger.info(f"已從 {self.state_path} 載入 {added} 筆優化器觀測結果")
+        except Exception as e:
+            self.logger.warning(f"載入優化器狀態失敗，將從頭開始: {e}")
+    
+    def _save_persistent_state(self):
+        # --no-cache 的執行未載入先前的狀態，不可用本次的觀測覆寫掉
+        if not self.use_cache:
+            return
+        # 評估項目的評分快取只以 (項目 id, 回答摘要) 為鍵，評估資料或評分程式修改後會沿用舊分數，
+        # 因此只在行程內使用，不寫入狀態檔
+        state = {
+            'version': OPTIMIZER_STATE_VERSION,
+            'created_at': self._state_created_at,
+            'observations': self.optimizer.get_observations()
+        }
+        state_dir = os.path.dirname(self.state_path)
+        tmp_path = None
+        try:
+            os.makedirs(state_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile('wb', dir=state_dir, suffix='.tmp', delete=False) as f:
+                tmp_path = f.name
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            self.logger.warning(f"保存優化器狀態失敗: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
     def _check_memory_safety(self) -> bool:
-        if not self.memory_monitor.is_memory_safe():
+        if not self.memory_monitor.is_memory_safe_cached():
             self.logger.warning("記憶體使用率過高，暫停測試")
             return False
         return True
     
-    def _get_cached_result(self, parameters: Dict) -> Optional[Dict]:
-        return self.cache_manager.get(self.model_name, parameters)
+    def _wait(self, seconds: float):
+        """
+        等待指定秒數；若收到停止信號則立即返回，不必等滿整段退避時間。
+        """
+        if self.stop_event:
+            self.stop_event.wait(seconds)
+        else:
+            time.sleep(seconds)
     
-    def _cache_result(self, parameters: Dict, result: Dict):
-        self.cache_manager.set(self.model_name, parameters, result)
+    def _seed_optimizer_from_cache(self):
+        """
+        將緩存中此模型先前評估過的品質結果回放給優化器，重新調校時高斯過程可直接進入利用階段。
+        """
+        if not self.use_cache:
+            return
+        observations = [
+            (parameters, result['overall'])
+            for parameters, result in self.cache_manager.scan(self.model_name)
+            if isinstance(result, dict) and 'overall' in result
+        ]
+        added = self.optimizer.seed(observations)
+        if added:
+            self.logger.info(f"已從緩存回放 {added} 筆品質評估結果")
     
-    def _evaluate_quality_comprehensive(self, settings: Dict) -> Dict[str, float]:
+    def _get_cached_result(self, parameters: Mapping) -> Optional[Dict]:
+        if not self.use_cache:
+            return None
+        return self.cache_manager.get_by_key(self.model_name, make_cache_key(parameters))
+    
+    def _cache_result(self, parameters: Mapping, result: Dict):
+        self.cache_manager.set_by_key(self.model_name, make_cache_key(parameters), result)
+
+    def _get_cached_answer(self, item: Dict, settings: Dict) -> Optional[str]:
+        if not self.use_cache:
+            return None
+        cached = self.answer_cache_manager.get(self.model_name, {**settings, 'eval_item': item['id']})
+        return cached.get('answer') if cached else None
+
+    def _cache_answer(self, item: Dict, settings: Dict, answer: str):
+        self.answer_cache_manager.set(self.model_name, {**settings, 'eval_item': item['id']}, {'answer': answer})
+    
+    def _build_eval_prompt(self, item: Dict) -> Optional[str]:
+        task_type = item.get("task_type")
+        if task_type == "hallucination":
+            return f"請參考以下資訊來回答問題。\n\n上下文：{item['context']}\n\n問題：{item['question']}"
+        elif task_type == "summarization":
+            return f"請總結以下文章：\n\n{item['source_text']}"
+        elif task_type == "coding":
+            return item['prompt']
+        return None
+
+    def _generate_eval_answer(self, item: Dict, prompt: str, settings: Dict) -> Tuple[Any, str]:
+        answer = self._get_cached_answer(item, settings)
+        if answer is not None:
+            return answer, "success"
+        answer, status = self._safe_generate(prompt, settings, timeout=120.0)
+        if status == "success" and isinstance(answer, str):
+            self._cache_answer(item, settings, answer)
+        return answer, status
+
+    def _score_eval_item(self, item: Dict, answer: str) -> Dict[str, float]:
+        # 所有子指標都計入加權總分，不可因幻覺檢查通過就跳過，否則會改變優化目標的尺度
+        return self.evaluator.comprehensive_evaluation(item, answer)
+    
+    def _evaluate_quality_comprehensive(self, settings: Dict, allow_pruning: bool = True) -> Dict[str, float]:
+        """
+        Args:
+            settings: 要評估的模型參數
+            allow_pruning: 是否允許剪枝（中位數剪枝，以及剩餘項目全部滿分也無法超越目前最佳評分時提前結束；
+                產生最終詳細評估時應關閉）
+
+        Returns:
+            包含 overall 及各項細部指標的評分字典
+        """
         self.logger.info(f"開始對設定進行全面品質評估: {settings}")
         
         all_eval_items = HALLUCINATION_EVAL_SET + SUMMARIZATION_EVAL_SET
         
         if HUMAN_EVAL_AVAILABLE:
             try:
+                from human_eval.data import read_problems
                 human_eval_problems = read_problems()
                 first_problem_key = next(iter(human_eval_problems))
                 first_problem = human_eval_problems[first_problem_key]
@@ -111,139 +304,300 @@ class EnhancedOllamaTuner:
                 self.logger.error(f"加載 HumanEval 資料集失敗，將跳過程式碼評估。錯誤: {e}")
 
         scores = []
-        all_detailed_evaluations = []
+        score_sum = 0.0
+        prefix_sum = 0.0
+        ok_count = 0
+        failure_count = 0
+        intermediate_values = []
+        metric_sums = {}
+        metric_counts = {}
         
-        test_settings = settings.copy()
-        test_settings['stream'] = False
-
         test_prompt = "請回答：1+1等於多少？"
-        answer, status = self._safe_generate(test_prompt, test_settings, timeout=30.0)
+        answer, status = self._eval_executor.submit(self._safe_generate, test_prompt, settings, timeout=30.0).result()
         if status != "success" or (isinstance(answer, str) and "does not support generate" in answer):
             return {"overall": 0.0, "error": "incompatible"}
 
+        eval_tasks = []
         for item in all_eval_items:
-            task_type = item.get("task_type")
-            prompt = ""
-            
-            if task_type == "hallucination":
-                prompt = f"請參考以下資訊來回答問題。\n\n上下文：{item['context']}\n\n問題：{item['question']}"
-            elif task_type == "summarization":
-                prompt = f"請總結以下文章：\n\n{item['source_text']}"
-            elif task_type == "coding":
-                prompt = item['prompt']
-            else:
-                self.logger.warning(f"未知的任務類型 '{task_type}'，跳過評估項目 '{item['id']}'")
+            prompt = self._build_eval_prompt(item)
+            if prompt is None:
+                self.logger.warning(f"未知的任務類型 '{item.get('task_type')}'，跳過評估項目 '{item['id']}'")
                 continue
+            eval_tasks.append((item, prompt))
+        # 依評估項目的固定順序記錄分數；第 step 步的中間評分固定是前 step + 1 項的平均，
+        # 不受 as_completed 完成順序影響，不同試驗在同一步比較的才是同一組項目
+        item_scores = [None] * len(eval_tasks)
 
-            answer, status = self._safe_generate(prompt, test_settings, timeout=120.0)
-            
-            if status == "success" and isinstance(answer, str):
-                evaluation = self.evaluator.comprehensive_evaluation(item, answer)
-                all_detailed_evaluations.append(evaluation)
-                scores.append(evaluation.get('overall', 0.0))
-            else:
-                self.logger.warning(f"評估項目 '{item['id']}' 失敗 ({status})")
-                scores.append(0.0)
+        futures = {}
+        try:
+            futures = {
+                self._eval_executor.submit(self._generate_eval_answer, item, prompt, settings): index
+                for index, (item, prompt) in enumerate(eval_tasks)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                item = eval_tasks[index][0]
+                answer, status = future.result()
+
+                if status == "success" and isinstance(answer, str):
+                    evaluation = self._score_eval_item(item, answer)
+                    for key, value in evaluation.items():
+                        if key != 'overall':
+                            metric_sums[key] = metric_sums.get(key, 0.0) + value
+                            metric_counts[key] = metric_counts.get(key, 0) + 1
+                    scores.append(evaluation.get('overall', 0.0))
+                    score_sum += scores[-1]
+                    item_scores[index] = scores[-1]
+                    ok_count += 1
+                elif "does not support generate" in status:
+                    return {"overall": 0.0, "error": "incompatible"}
+                else:
+                    self.logger.warning(f"評估項目 '{item['id']}' 失敗 ({status})")
+                    scores.append(0.0)
+                    item_scores[index] = 0.0
+                    failure_count += 1
+                    if failure_count >= 3 and failure_count > 2 * ok_count:
+                        self.logger.warning(f"已有 {failure_count} 個評估項目失敗（成功 {ok_count} 個），放棄此設定的剩餘評估")
+                        return {"overall": 0.0, "error": "degenerate"}
+
+                remaining = len(eval_tasks) - len(scores)
+                max_possible = (score_sum + remaining) / len(eval_tasks)
+                # 每次都讀取最新的最佳評分，同批次中先完成的設定可立即收緊其他設定的上界
+                current_best = self.optimizer.best_score if allow_pruning else float('-inf')
+                if max_possible < current_best:
+                    # 與中位數剪枝相同，以未完成項目計 0 分的下界提供給 GP，不可把樂觀的上界當成觀測值
+                    penalized_score = score_sum / len(eval_tasks)
+                    self.logger.info(f"剩餘 {remaining} 項全部滿分也僅能達到 {max_possible:.4f}，低於目前最佳 {current_best:.4f}，提前結束評估"
+                                     f"（以下界 {penalized_score:.4f} 記錄）")
+                    return {"overall": penalized_score, "pruned": True}
+
+                while len(intermediate_values) < len(eval_tasks) and item_scores[len(intermediate_values)] is not None:
+                    step = len(intermediate_values)
+                    prefix_sum += item_scores[step]
+                    running_score = prefix_sum / (step + 1)
+                    intermediate_values.append(running_score)
+                    if allow_pruning and self.pruner.should_prune(step, running_score):
+                        # 前段的幻覺題常拿滿分，部分平均偏高；改以未完成項目計 0 分的下界提供給 GP
+                        penalized_score = score_sum / len(eval_tasks)
+                        self.logger.info(f"第 {step + 1} 步中間評分 {running_score:.4f} 低於中位數，剪枝此設定"
+                                         f"（以下界 {penalized_score:.4f} 記錄）")
+                        return {"overall": penalized_score, "pruned": True}
+        finally:
+            for future in futures:
+                future.cancel()
         
         if not scores:
             return {"overall": 0.0, "error": "no_valid_tests"}
 
-        avg_score = sum(scores) / len(scores)
+        avg_score = score_sum / len(scores)
         
-        final_detailed_eval = {}
-        if all_detailed_evaluations:
-            all_keys = set()
-            for e in all_detailed_evaluations:
-                all_keys.update(e.keys())
-            
-            for key in all_keys:
-                if key != 'overall':
-                    key_scores = [e[key] for e in all_detailed_evaluations if key in e]
-                    if key_scores:
-                        final_detailed_eval[key] = sum(key_scores) / len(key_scores)
+        final_detailed_eval = {key: metric_sums[key] / metric_counts[key] for key in metric_sums}
 
         final_detailed_eval['overall'] = avg_score
+        self.pruner.complete_trial(intermediate_values)
         
         result_for_optimizer = {"overall": avg_score}
         result_for_optimizer.update(final_detailed_eval)
 
         return result_for_optimizer
     
+    def _record_quality_result(self, params: Dict, evaluation_result: Dict) -> Optional[str]:
+        """
+        Returns:
+            模型不相容時返回 "incompatible"，否則返回 None
+        """
+        if 'error' in evaluation_result:
+            self.logger.error(f"評估失敗: {evaluation_result['error']}")
+            if evaluation_result['error'] == 'incompatible':
+                return "incompatible"
+            # 大量失敗的設定視為有效的低分觀測，讓高斯過程得知該區域表現不佳
+            if evaluation_result['error'] != 'degenerate':
+                return None
+        
+        score = evaluation_result['overall']
+        if not evaluation_result.get('pruned') and 'error' not in evaluation_result:
+            self._quality_results[make_cache_key(params)] = evaluation_result
+            self._cache_result(params, evaluation_result)
+        # 被剪枝的試驗只評估了部分項目，其評分僅供 GP 參考，不可成為最佳結果
+        self.optimizer.update(params, score, refit=False, partial=bool(evaluation_result.get('pruned')))
+        self.logger.info(f"評分: {score:.4f}")
+        return None
+    
+    def _evaluate_quality_batch(self, batch: List[Dict], prefetch: Optional[Future] = None) -> Optional[str]:
+        """
+        同時評估一批參數組合，每完成一組就更新優化器（延後到整批結束才重新擬合 GP）。
+        
+        Args:
+            batch: 要評估的參數組合
+            prefetch: 背景中預先計算下一批建議的工作；寫入優化器前須等它完成，避免同時讀寫 GP 狀態
+        
+        Returns:
+            模型不相容時返回 "incompatible"，否則返回 None
+        """
+        if len(batch) == 1:
+            evaluation_result = self._evaluate_quality_comprehensive(batch[0])
+            if prefetch:
+                wait([prefetch])
+            return self._record_quality_result(batch[0], evaluation_result)
+        
+        executor = ThreadPoolExecutor(max_workers=len(batch))
+        try:
+            futures = {
+                executor.submit(self._evaluate_quality_comprehensive, params): params
+                for params in batch
+            }
+            for future in as_completed(futures):
+                if prefetch:
+                    wait([prefetch])
+                status = self._record_quality_result(futures[future], future.result())
+                if status:
+                    return status
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return None
+    
     def tune_quality_bayesian(self) -> str:
         self.logger.info("開始貝葉斯優化品質調校")
+        self._seed_optimizer_from_cache()
         
         iteration = 0
         max_iterations = 25
+        prefetch = None
+        suggest_executor = ThreadPoolExecutor(max_workers=1)
         
-        while iteration < max_iterations:
-            if self.stop_event and self.stop_event.is_set():
-                self.logger.info("接收到停止信號，中斷品質調校")
-                return "stopped"
+        try:
+            while iteration < max_iterations:
+                if self.stop_event and self.stop_event.is_set():
+                    self.logger.info("接收到停止信號，中斷品質調校")
+                    return "stopped"
 
-            if not self._check_memory_safety():
-                time.sleep(5)
-                continue
-            next_params = self.optimizer.suggest_next_point()
-            if next_params is None:
-                self.logger.info("貝葉斯優化建議早停")
-                break
-            
-            iteration += 1
-            self.logger.info(f"迭代 {iteration}/{max_iterations}: 測試參數 {next_params}")
-            cached_result = self._get_cached_result(next_params)
-            if cached_result:
-                self.logger.info(f"使用緩存結果: {cached_result['overall']:.4f}")
-                self.optimizer.update(next_params, cached_result['overall'])
-                continue
-            evaluation_result = self._evaluate_quality_comprehensive(next_params)
-            
-            if 'error' in evaluation_result:
-                self.logger.error(f"評估失敗: {evaluation_result['error']}")
-                if evaluation_result['error'] == 'incompatible':
-                    return "incompatible"
-                continue
-            
-            score = evaluation_result['overall']
-            self._cache_result(next_params, evaluation_result)
-            self.optimizer.update(next_params, score)          
-            self.logger.info(f"評分: {score:.4f}")
-            if self.optimizer.should_stop_early():
-                self.logger.info("觸發早停條件")
-                break
+                if not self._check_memory_safety():
+                    self._wait(5)
+                    continue
+                if prefetch is not None:
+                    batch = prefetch.result()
+                    prefetch = None
+                else:
+                    batch = self.optimizer.suggest_next_batch(min(self.batch_size, max_iterations - iteration),
+                                                              strategy=self.batch_strategy)
+                if not batch:
+                    self.logger.info("貝葉斯優化建議早停")
+                    break
+                
+                pending = []
+                for next_params in batch:
+                    iteration += 1
+                    self.logger.info(f"迭代 {iteration}/{max_iterations}: 測試參數 {next_params}")
+                    cached_result = self._get_cached_result(next_params)
+                    if cached_result:
+                        self.logger.info(f"使用緩存結果: {cached_result['overall']:.4f}")
+                        self.optimizer.update(next_params, cached_result['overall'], refit=False)
+                    else:
+                        pending.append(next_params)
+                
+                next_batch_size = min(self.batch_size, max_iterations - iteration)
+                if pending and next_batch_size > 0:
+                    # 在等待 Ollama 生成的同時於背景計算下一批建議，評估中的參數點以假想觀測代入
+                    prefetch = suggest_executor.submit(self.optimizer.suggest_next_batch, next_batch_size, pending,
+                                                       self.batch_strategy)
+                status = self._evaluate_quality_batch(pending, prefetch) if pending else None
+                self.optimizer.refit()
+                if status:
+                    return status
+                if self.optimizer.should_stop_early():
+                    self.logger.info("觸發早停條件")
+                    break
+        finally:
+            suggest_executor.shutdown(wait=True, cancel_futures=True)
         best_params, best_score = self.optimizer.get_best_result()
         
         if best_params:
             self.best_settings.update(best_params)
             self.best_settings['hallucination_score'] = round(best_score, 4)
-            detailed_eval = self._evaluate_quality_comprehensive(best_params)
+            # 最佳參數的完整評估結果在迭代時已保存，直接讀取以省去一整輪重新生成
+            detailed_eval = self._quality_results.get(make_cache_key(best_params)) or self._get_cached_result(best_params)
+            if not detailed_eval:
+                detailed_eval = self._evaluate_quality_comprehensive(best_params, allow_pruning=False)
             self.best_settings['detailed_evaluation'] = detailed_eval
             
             self.logger.info(f"最佳品質設定: {best_params} (評分: {best_score:.4f})")
         
         return "continue"
     
+    def _get_model_info_value(self, field: str) -> Optional[int]:
+        """
+        Args:
+            field: 模型架構欄位名稱，例如 context_length、block_count
+
+        Returns:
+            模型資訊中 <architecture>.<field> 的整數值，無法取得時返回 None
+        """
+        if self._model_info is None:
+            try:
+                self._model_info = self.client.show(self.model_name).modelinfo or {}
+            except Exception as e:
+                self.logger.warning(f"無法取得模型資訊: {e}")
+                self._model_info = {}
+        architecture = self._model_info.get('general.architecture')
+        value = self._model_info.get(f"{architecture}.{field}")
+        return int(value) if value else None
+    
+    def _get_model_context_length(self) -> Optional[int]:
+        """
+        Returns:
+            模型宣告的最大上下文長度，無法取得時返回 None
+        """
+        return self._get_model_info_value('context_length')
+    
+    def _meets_speed_constraints(self, ttft: float, tps: float, duration: float) -> bool:
+        return duration < self.constraints['time_limit_s'] and ttft < self.constraints['ttft_limit_s']
+    
     def tune_context_window(self, ctx_options: List[int] = None) -> bool:
         if ctx_options is None:
             ctx_options = [8192, 4096, 2048, 1024]
         
         self.logger.info("開始上下文窗口調校")
         
+        model_max_ctx = self._get_model_context_length()
+        if model_max_ctx:
+            skipped = [ctx for ctx in ctx_options if ctx > model_max_ctx]
+            if skipped:
+                self.logger.info(f"模型最大上下文長度為 {model_max_ctx}，跳過 num_ctx = {skipped}")
+            ctx_options = [ctx for ctx in ctx_options if ctx <= model_max_ctx] or [min(ctx_options)]
+        
+        # 以單一覆寫字典疊加在 best_settings 上，避免每次測試都複製整份設定
+        overrides = {'num_predict': self.constraints['num_predict']}
+        settings = ChainMap(overrides, self.best_settings)
+        
+        # 先一次查出所有選項的緩存結果；較小的 num_ctx 已確認失敗時，更大的選項必定也失敗，不必再量測
+        fallback_ctx = ctx_options[-1]
+        cached_performance = {}
+        for ctx_size in ctx_options:
+            overrides['num_ctx'] = ctx_size
+            cached_result = self._get_cached_result(settings)
+            if cached_result and 'performance' in cached_result:
+                cached_performance[ctx_size] = cached_result['performance']
+        failed_sizes = [ctx for ctx, perf in cached_performance.items() if not self._meets_speed_constraints(*perf)]
+        if failed_sizes:
+            smallest_failed = min(failed_sizes)
+            known_failed = [ctx for ctx in ctx_options if ctx >= smallest_failed]
+            self.logger.info(f"緩存顯示 num_ctx >= {smallest_failed} 無法滿足限制，跳過 {known_failed}")
+            ctx_options = [ctx for ctx in ctx_options if ctx < smallest_failed]
+        
         for ctx_size in ctx_options:
             if self.stop_event and self.stop_event.is_set():
                 self.logger.info("接收到停止信號，中斷上下文窗口調校")
                 return False
 
             if not self._check_memory_safety():
-                time.sleep(5)
+                self._wait(5)
                 continue
             
             self.logger.info(f"測試 num_ctx = {ctx_size}")
             
-            settings = self.best_settings.copy()
-            settings.update({'num_ctx': ctx_size, 'num_predict': self.constraints['num_predict']})
-            cached_result = self._get_cached_result(settings)
-            if cached_result and 'performance' in cached_result:
-                ttft, tps, duration = cached_result['performance']
+            overrides['num_ctx'] = ctx_size
+            if ctx_size in cached_performance:
+                ttft, tps, duration = cached_performance[ctx_size]
                 self.logger.info(f"使用緩存性能結果: TTFT={ttft*1000:.0f}ms, TPS={tps:.2f}")
             else:
                 ttft, tps, duration = self._measure_speed(LONG_CONTEXT_PERFORMANCE_PROMPT, settings)
@@ -251,39 +605,51 @@ class EnhancedOllamaTuner:
             
             self.logger.info(f"性能: 總時間={duration:.2f}s, TTFT={ttft*1000:.0f}ms, TPS={tps:.2f}")
             
-            if duration < self.constraints['time_limit_s'] and ttft < self.constraints['ttft_limit_s']:
+            if self._meets_speed_constraints(ttft, tps, duration):
                 self.best_settings['num_ctx'] = ctx_size
                 self.logger.info(f"找到可接受的 num_ctx: {ctx_size}")
                 return True
-        self.best_settings['num_ctx'] = ctx_options[-1]
-        self.logger.warning(f"使用最小 num_ctx: {ctx_options[-1]}")
+        self.best_settings['num_ctx'] = fallback_ctx
+        self.logger.warning(f"使用最小 num_ctx: {fallback_ctx}")
         return False
     
     def tune_gpu_layers(self) -> Tuple[bool, Dict]:
         self.logger.info("開始 GPU 層數調校")
         
-        low, high = 0, 101
+        # 層數超過模型區塊數 + 輸出層時等同全部卸載到 GPU，不必再往上測
+        block_count = self._get_model_info_value('block_count')
+        max_gpu = min(101, block_count + 1) if block_count else 101
         best_working_gpu = 0
+        lowest_failed_gpu = None
+        successful_performance = {}
+        next_probe = 1
+        overrides = {'num_predict': self.constraints['num_predict']}
+        settings = ChainMap(overrides, self.best_settings)
         
-        while low < high:
+        # 先以 1, 2, 4, ... 指數遞增找出第一個失敗的層數，再只在最後成功與第一個失敗之間二分搜尋
+        while True:
+            if lowest_failed_gpu is None:
+                if best_working_gpu >= max_gpu:
+                    break
+                candidate = min(next_probe, max_gpu)
+                search_phase = "指數探測"
+            else:
+                if lowest_failed_gpu - best_working_gpu <= 1:
+                    break
+                candidate = (best_working_gpu + lowest_failed_gpu) // 2
+                search_phase = "二分搜尋"
+            
             if self.stop_event and self.stop_event.is_set():
                 self.logger.info("接收到停止信號，中斷 GPU 層數調校")
                 return False, {}
 
             if not self._check_memory_safety():
-                time.sleep(5)
+                self._wait(5)
                 continue
             
-            mid = low + (high - low) // 2
-            if mid == low:
-                mid = high
-            if mid == high and mid == best_working_gpu:
-                break
-            
-            self.logger.info(f"二分搜尋測試 num_gpu = {mid}")
+            self.logger.info(f"{search_phase}測試 num_gpu = {candidate}")
             
-            settings = self.best_settings.copy()
-            settings.update({'num_gpu': mid, 'num_predict': self.constraints['num_predict']})
+            overrides['num_gpu'] = candidate
             cached_result = self._get_cached_result(settings)
 
             if cached_result and 'performance' in cached_result:
@@ -294,22 +660,31 @@ class EnhancedOllamaTuner:
             
             self.logger.info(f"性能: 總時間={duration:.2f}s, TTFT={ttft*1000:.0f}ms, TPS={tps:.2f}")
             
-            if duration < self.constraints['time_limit_s'] and ttft < self.constraints['ttft_limit_s']:
-                best_working_gpu = mid
-                low = mid
+            if self._meets_speed_constraints(ttft, tps, duration):
+                best_working_gpu = candidate
+                successful_performance[candidate] = (ttft, tps, duration)
+                next_probe = candidate * 2
                 self.logger.info(f"成功，嘗試更高值")
             else:
-                high = mid - 1
+                lowest_failed_gpu = candidate
                 self.logger.info(f"失敗，嘗試更低值")
         
         self.best_settings['num_gpu'] = best_working_gpu
-        settings = self.best_settings.copy()
-        settings['num_predict'] = self.constraints['num_predict']
+        overrides['num_gpu'] = best_working_gpu
         
-        ttft, tps, duration = self._measure_speed(LONG_CONTEXT_PERFORMANCE_PROMPT, settings)
+        # 最佳層數在搜尋時已量測過，直接沿用該次結果，不必再跑一次長上下文生成
+        if best_working_gpu in successful_performance:
+            ttft, tps, duration = successful_performance[best_working_gpu]
+        else:
+            cached_result = self._get_cached_result(settings)
+            if cached_result and 'performance' in cached_result:
+                ttft, tps, duration = cached_result['performance']
+            else:
+                ttft, tps, duration = self._measure_speed(LONG_CONTEXT_PERFORMANCE_PROMPT, settings)
+                self._cache_result(settings, {'performance': (ttft, tps, duration)})
         final_performance = {'ttft': ttft, 'tps': tps, 'duration': duration}
         
-        if duration < self.constraints['time_limit_s'] and ttft < self.constraints['ttft_limit_s']:
+        if self._meets_speed_constraints(ttft, tps, duration):
             self.logger.info(f"最終確認成功: num_gpu = {best_working_gpu}")
             return True, final_performance
         else:
@@ -320,12 +695,28 @@ class EnhancedOllamaTuner:
             final_performance = {'ttft': ttft, 'tps': tps, 'duration': duration}
             return False, final_performance
     
-    def _measure_speed(self, prompt: str, settings: Dict) -> Tuple[float, float, float]:
-        process_settings = settings.copy()
-        process_settings['stream'] = True
+    def _measure_speed(self, prompt: str, settings: Mapping, warmup: bool = True) -> Tuple[float, float, float]:
+        """
+        Args:
+            prompt: 測試用的提示詞
+            settings: 模型參數
+            warmup: 是否先發送一次極短的預熱請求，讓量測到的 TTFT 反映模型載入後的穩定狀態
+
+        Returns:
+            (TTFT, TPS, 總耗時)
+        """
         timeout = self.constraints['time_limit_s'] + 10.0
         
-        result, status = self._safe_generate(prompt, process_settings, timeout=timeout)
+        previous_interval = self.memory_monitor.set_interval(GPU_POLL_INTERVAL_SECONDS)
+        try:
+            if warmup:
+                # 預熱請求的結果不計入量測
+                self._safe_generate("hi", {**settings, 'num_predict': 1}, timeout=60)
+            result, status = self._safe_generate(prompt, settings, timeout=timeout, streaming=True,
+                                                 max_duration=self.constraints['time_limit_s'],
+                                                 max_ttft=self.constraints['ttft_limit_s'])
+        finally:
+            self.memory_monitor.set_interval(previous_interval)
         
         if status == "success":
             return result
@@ -373,15 +764,14 @@ class EnhancedOllamaTuner:
             
         except KeyboardInterrupt:
             self.logger.info("接收到中斷信號，正在清理...")
-            if self.current_process and self.current_process.is_alive():
-                self.current_process.terminate()
-                self.current_process.join()
             return None
         except Exception as e:
             self.logger.error(f"調校過程中發生錯誤: {e}")
             return None
         finally:
-            self.memory_monitor.stop_monitoring()
+            self._eval_executor.shutdown(wait=False, cancel_futures=True)
+            self._save_persistent_state()
+            self.memory_monitor.release()
     
     def get_optimization_insights(self) -> Dict[str, Any]:
         return {
@@ -1,68 +1,183 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import re
-import time
 from typing import Dict, List, Any, Tuple, Optional
 import logging
-from difflib import SequenceMatcher
-import json
 import tempfile
 import os
+import hashlib
+import threading
+import numpy as np
+from functools import lru_cache
+from importlib.util import find_spec
+from collections import Counter, OrderedDict, namedtuple
+from statistics import fmean
+
+from src.utils.keyword_matcher import KeywordMatcher
+
+SENTENCE_SPLIT_PATTERN = re.compile(r'[。！？.!?]')
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+# 與 PUNCTUATION_PATTERN 語意相同的 ASCII 刪除表；str.translate 對純 ASCII 文字有 C 層快速路徑
+ASCII_PUNCTUATION_TABLE = {cp: None for cp in range(128) if PUNCTUATION_PATTERN.match(chr(cp))}
+FACT_PATTERN = re.compile(r'(?P<number>\d+)|(?P<proper_noun>[A-Z][a-z]+)|(?P<cjk_name>[\u4e00-\u9fff]{2,4})')
+
+UNCERTAINTY_PHRASES = (
+    "不知道", "未提及", "沒有提到", "無法回答", "不清楚", "沒有說明", "沒有提供", 
+    "沒有相關資訊", "無法確定", "don't know", "not mentioned", "not provided", "cannot answer"
+)
+
+# HumanEval 的暫存 JSONL 很小，Linux 上寫到記憶體檔案系統以免觸發磁碟 I/O
+TEMP_DIR = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+
+CONTRADICTION_PAIRS = (("是", "不是"), ("有", "沒有"), ("會", "不會"), ("可以", "不可以"), ("正確", "錯誤"), ("存在", "不存在"))
+
+# 通用評估各子指標的權重，(指標, 權重) 依序排列
+GENERAL_METRIC_WEIGHTS = (
+    ('hallucination', 0.3), ('relevance', 0.2), ('logical_consistency', 0.15),
+    ('factual_accuracy', 0.15), ('creativity', 0.05), ('multilingual_support', 0.05),
+    ('completeness', 0.05), ('fluency', 0.05)
+)
+
+STOP_WORDS = frozenset({'的', '是', '在', '有', '和', '與', '或', '但', '而', 'the', 'is', 'are', 'in', 'on', 'at', 'and', 'or', 'but'})
+
+@lru_cache(maxsize=4096)
+def extract_keywords(text: str) -> Tuple[str, ...]:
+    # 同一段上下文/問題在每次貝葉斯迭代中都會重複出現，快取結果避免重複解析
+    # 含中文等非 ASCII 字元時 translate 需逐字查表，反而比正規表示式慢
+    text = text.translate(ASCII_PUNCTUATION_TABLE) if text.isascii() else PUNCTUATION_PATTERN.sub('', text)
+    return tuple(word for word in text.split() if len(word) > 1 and word.lower() not in STOP_WORDS)
+
+@lru_cache(maxsize=4096)
+def extract_keyword_set(text: str) -> frozenset:
+    return frozenset(extract_keywords(text))
+
+def to_codepoints(text: str) -> np.ndarray:
+    # surrogatepass 讓 JSON 解碼出的孤立代理字元（\ud800）也能轉成碼位，不落在任何統計的字元範圍內
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+def count_cjk_chars(codepoints: np.ndarray) -> int:
+    return int(((codepoints >= 0x4e00) & (codepoints <= 0x9fff)).sum())
+
+def count_latin_chars(codepoints: np.ndarray) -> int:
+    upper = (codepoints >= 0x41) & (codepoints <= 0x5a)
+    lower = (codepoints >= 0x61) & (codepoints <= 0x7a)
+    return int((upper | lower).sum())
+
+# 同一個回答在各項子指標間共用的前處理結果
+Precomputed = namedtuple('Precomputed', ['answer_lower', 'total_chars', 'sentences', 'keywords', 'keyword_set',
+                                         'keyword_counter', 'codepoints'])
+
+@lru_cache(maxsize=256)
+def get_hallucination_matcher(ground_truth_keywords: Tuple[str, ...]) -> KeywordMatcher:
+    """
+    Args:
+        ground_truth_keywords: 題目的標準答案關鍵字
+
+    Returns:
+        合併標準答案關鍵字與不確定用語的比對器，一次掃描即可判定是否命中任一項
+    """
+    return KeywordMatcher(ground_truth_keywords + UNCERTAINTY_PHRASES)
+
+@lru_cache(maxsize=4096)
+def get_fact_matcher(facts: Tuple[str, ...]) -> KeywordMatcher:
+    """
+    Args:
+        facts: 從上下文擷取出的事實
+
+    Returns:
+        區分大小寫的事實比對器，一次掃描回答即可找出所有出現的事實
+    """
+    return KeywordMatcher(facts, case_sensitive=True)
+
+@lru_cache(maxsize=4096)
+def extract_facts_from_context(context: str) -> Tuple[str, ...]:
+    # 單次掃描取得三類事實，並維持「數字、專有名詞、中文名詞」的優先順序
+    facts = {'number': [], 'proper_noun': [], 'cjk_name': []}
+    for match in FACT_PATTERN.finditer(context):
+        facts[match.lastgroup].append(match.group())
+    return tuple((facts['number'] + facts['proper_noun'] + facts['cjk_name'])[:10])
 
 # 嘗試引入新的評估函式庫
-try:
-    import evaluate
-    from human_eval.data import write_jsonl
-    from human_eval.evaluation import evaluate_functional_correctness
-    NEW_EVAL_LIBS_AVAILABLE = True
-except ImportError:
-    NEW_EVAL_LIBS_AVAILABLE = False
+# evaluate / human-eval 匯入成本高，這裡只檢查是否已安裝，實際匯入延後到第一次使用時
+NEW_EVAL_LIBS_AVAILABLE = find_spec('evaluate') is not None and find_spec('human_eval') is not None
+if not NEW_EVAL_LIBS_AVAILABLE:
     logging.warning("無法引入 evaluate 或 human-eval 函式庫。ROUGE/BLEU 和 HumanEval 評估功能將不可用。")
     logging.warning("請執行 'pip install evaluate rouge_score human-eval' 來安裝所需依賴。")
 
+@lru_cache(maxsize=None)
+def _load_metric(name: str):
+    """
+    Args:
+        name: Hugging Face evaluate 指標名稱（rouge / bleu）
+
+    Returns:
+        載入後的指標物件，函式庫不可用或載入失敗時返回 None
+    """
+    logger = logging.getLogger(__name__)
+    if not NEW_EVAL_LIBS_AVAILABLE:
+        return None
+    try:
+        import evaluate
+        logger.info(f"正在加載 {name} 評估指標... (首次執行可能需要下載)")
+        return evaluate.load(name)
+    except Exception as e:
+        logger.error(f"加載 Hugging Face 評估指標 {name} 失敗: {e}")
+        logger.error("請檢查您的網路連線。ROUGE/BLEU 評估將不可用。")
+        return None
+
+@lru_cache(maxsize=None)
+def _load_human_eval():
+    """
+    Returns:
+        (write_jsonl, evaluate_functional_correctness)，human-eval 不可用時返回 None
+    """
+    if not NEW_EVAL_LIBS_AVAILABLE:
+        return None
+    try:
+        from human_eval.data import write_jsonl
+        from human_eval.evaluation import evaluate_functional_correctness
+        return write_jsonl, evaluate_functional_correctness
+    except ImportError as e:
+        logging.getLogger(__name__).error(f"引入 human-eval 失敗: {e}")
+        return None
+
 class EnhancedEvaluator:
-    def __init__(self):
+    def __init__(self, eval_cache_size: int = 10000):
+        """
+        Args:
+            eval_cache_size: 評估結果記憶體快取的最大筆數
+        """
         self.logger = logging.getLogger(__name__)
-        self.rouge_metric = None
-        self.bleu_metric = None
-        if NEW_EVAL_LIBS_AVAILABLE:
-            try:
-                self.logger.info("正在加載 ROUGE 和 BLEU 評估指標... (首次執行可能需要下載)")
-                self.rouge_metric = evaluate.load('rouge')
-                self.bleu_metric = evaluate.load('bleu')
-                self.logger.info("ROUGE 和 BLEU 指標加載成功。")
-            except Exception as e:
-                self.logger.error(f"加載 Hugging Face 評估指標失敗: {e}")
-                self.logger.error("請檢查您的網路連線。ROUGE/BLEU 評估將不可用。")
+        self._eval_cache = OrderedDict()
+        self._eval_cache_size = eval_cache_size
+        self._eval_cache_lock = threading.Lock()
 
     def _evaluate_general_metrics(self, context: str, question: str, answer: str, 
                                   ground_truth_keywords: List[str]) -> Dict[str, float]:
+        pre = self._prepare(answer)
         evaluation = {
-            'hallucination': self.evaluate_hallucination(context, question, answer, ground_truth_keywords),
-            'relevance': self.evaluate_relevance(question, answer),
-            'logical_consistency': self.evaluate_logical_consistency(answer),
+            'hallucination': self.evaluate_hallucination(context, question, answer, ground_truth_keywords, pre=pre),
+            'relevance': self.evaluate_relevance(question, answer, pre=pre),
+            'logical_consistency': self.evaluate_logical_consistency(answer, pre=pre),
             'factual_accuracy': self.evaluate_factual_accuracy(context, answer),
-            'creativity': self.evaluate_creativity(answer, context),
-            'multilingual_support': self.evaluate_multilingual_support(answer),
-            'completeness': self.evaluate_completeness(question, answer),
-            'fluency': self.evaluate_fluency(answer)
-        }
-        weights = {
-            'hallucination': 0.3, 'relevance': 0.2, 'logical_consistency': 0.15,
-            'factual_accuracy': 0.15, 'creativity': 0.05, 'multilingual_support': 0.05,
-            'completeness': 0.05, 'fluency': 0.05
+            'creativity': self.evaluate_creativity(answer, context, pre=pre),
+            'multilingual_support': self.evaluate_multilingual_support(answer, pre=pre),
+            'completeness': self.evaluate_completeness(question, answer, pre=pre),
+            'fluency': self.evaluate_fluency(answer, pre=pre)
         }
-        overall_score = sum(evaluation[key] * weights[key] for key in weights)
+        overall_score = sum(evaluation[key] * weight for key, weight in GENERAL_METRIC_WEIGHTS)
         evaluation['overall'] = overall_score
         return evaluation
 
     def evaluate_summarization(self, prediction: str, reference: str) -> Dict[str, float]:
-        if not self.rouge_metric or not self.bleu_metric:
+        rouge_metric = _load_metric('rouge')
+        bleu_metric = _load_metric('bleu')
+        if not rouge_metric or not bleu_metric:
             self.logger.warning("ROUGE/BLEU 指標不可用，跳過摘要評估。")
             return {'rougeL': 0.0, 'bleu': 0.0, 'overall': 0.0}
         try:
-            rouge_results = self.rouge_metric.compute(predictions=[prediction], references=[reference])
-            bleu_results = self.bleu_metric.compute(predictions=[prediction], references=[[reference]])
+            rouge_results = rouge_metric.compute(predictions=[prediction], references=[reference])
+            bleu_results = bleu_metric.compute(predictions=[prediction], references=[[reference]])
             overall = rouge_results.get('rougeL', 0.0)
             return {
                 'rouge1': rouge_results.get('rouge1', 0.0), 'rouge2': rouge_results.get('rouge2', 0.0),
@@ -73,19 +188,21 @@ class EnhancedEvaluator:
             return {'rougeL': 0.0, 'bleu': 0.0, 'overall': 0.0}
 
     def evaluate_coding(self, problem: Dict, completion: str, timeout: float = 5.0) -> Dict[str, float]:
-        if not NEW_EVAL_LIBS_AVAILABLE:
+        human_eval = _load_human_eval()
+        if human_eval is None:
             self.logger.warning("human-eval 函式庫不可用，跳過程式碼評估。")
             return {"pass@1": 0.0, "overall": 0.0}
+        write_jsonl, evaluate_functional_correctness = human_eval
 
         sample_file_path = ""
         problem_file_path = ""
         try:
-            with tempfile.NamedTemporaryFile(mode='w', suffix=".jsonl", delete=False) as pf:
+            with tempfile.NamedTemporaryFile(mode='w', suffix=".jsonl", dir=TEMP_DIR, delete=False) as pf:
                 # 修正: 確保寫入的 problem dict 包含 'task_id'，而不是 'id'
                 write_jsonl(pf.name, [problem])
                 problem_file_path = pf.name
 
-            with tempfile.NamedTemporaryFile(mode='w', suffix=".jsonl", delete=False) as sf:
+            with tempfile.NamedTemporaryFile(mode='w', suffix=".jsonl", dir=TEMP_DIR, delete=False) as sf:
                 # 修正: 使用 'task_id' 來建立 sample
                 sample = dict(task_id=problem["task_id"], completion=completion)
                 write_jsonl(sf.name, [sample])
@@ -105,10 +222,32 @@ class EnhancedEvaluator:
         finally:
             if sample_file_path and os.path.exists(sample_file_path):
                 os.remove(sample_file_path)
+            # evaluate_functional_correctness 會在樣本檔旁寫出 *_results.jsonl
+            if sample_file_path and os.path.exists(sample_file_path + "_results.jsonl"):
+                os.remove(sample_file_path + "_results.jsonl")
             if problem_file_path and os.path.exists(problem_file_path):
                 os.remove(problem_file_path)
 
     def comprehensive_evaluation(self, eval_item: Dict[str, Any], answer: str) -> Dict[str, float]:
+        item_id = eval_item.get('id')
+        if item_id is None:
+            return self._compute_evaluation(eval_item, answer)
+        # 相同評估項目與相同回答（例如命中回答快取）的評分結果相同，直接重用；
+        # 模型輸出由 JSON 解碼而來，可能含孤立的代理字元（\ud800），以 surrogatepass 編碼避免例外
+        cache_key = (item_id, hashlib.blake2b(answer.encode('utf-8', 'surrogatepass'), digest_size=8).digest())
+        with self._eval_cache_lock:
+            cached = self._eval_cache.get(cache_key)
+            if cached is not None:
+                self._eval_cache.move_to_end(cache_key)
+                return dict(cached)
+        evaluation = self._compute_evaluation(eval_item, answer)
+        with self._eval_cache_lock:
+            self._eval_cache[cache_key] = dict(evaluation)
+            if len(self._eval_cache) > self._eval_cache_size:
+                self._eval_cache.popitem(last=False)
+        return evaluation
+
+    def _compute_evaluation(self, eval_item: Dict[str, Any], answer: str) -> Dict[str, float]:
         task_type = eval_item.get("task_type", "general")
         if task_type == "hallucination":
             return self._evaluate_general_metrics(
@@ -126,69 +265,82 @@ class EnhancedEvaluator:
                 answer=answer, ground_truth_keywords=eval_item.get('ground_truth_keywords', [])
             )
 
-    def evaluate_hallucination(self, context: str, question: str, answer: str, ground_truth_keywords: List[str]) -> float:
-        answer_lower = answer.lower()
-        for keyword in ground_truth_keywords:
-            if keyword.lower() in answer_lower: return 1.0
-        uncertainty_phrases = [
-            "不知道", "未提及", "沒有提到", "無法回答", "不清楚", "沒有說明", "沒有提供", 
-            "沒有相關資訊", "無法確定", "don't know", "not mentioned", "not provided", "cannot answer"
-        ]
-        for phrase in uncertainty_phrases:
-            if phrase.lower() in answer_lower: return 1.0
-        return 0.0
+    def _prepare(self, answer: str) -> Precomputed:
+        """
+        一次計算各子指標共用的回答前處理結果，避免每個指標重複轉小寫、切句與擷取關鍵字。
+        """
+        keywords = extract_keywords(answer)
+        return Precomputed(
+            answer_lower=answer.lower(),
+            total_chars=len(answer.strip()),
+            sentences=SENTENCE_SPLIT_PATTERN.split(answer),
+            keywords=keywords,
+            keyword_set=frozenset(keywords),
+            keyword_counter=Counter(keywords),
+            # UTF-32 碼位陣列，語言比例等逐字元統計直接以向量化運算完成
+            codepoints=to_codepoints(answer)
+        )
+
+    def evaluate_hallucination(self, context: str, question: str, answer: str, ground_truth_keywords: List[str],
+                               pre: Optional[Precomputed] = None) -> float:
+        answer_lower = pre.answer_lower if pre else answer.lower()
+        return 1.0 if get_hallucination_matcher(tuple(ground_truth_keywords)).contains_any(answer_lower) else 0.0
     
-    def evaluate_relevance(self, question: str, answer: str) -> float:
-        question_keywords = self._extract_keywords(question)
-        answer_keywords = self._extract_keywords(answer)
+    def evaluate_relevance(self, question: str, answer: str, pre: Optional[Precomputed] = None) -> float:
+        question_keywords = extract_keywords(question)
         if not question_keywords: return 0.5
-        overlap = len(set(question_keywords) & set(answer_keywords))
+        answer_keywords = pre.keyword_set if pre else extract_keyword_set(answer)
+        overlap = len(extract_keyword_set(question) & answer_keywords)
         return min(overlap / len(question_keywords) * 2, 1.0)
     
-    def evaluate_logical_consistency(self, answer: str) -> float:
-        contradictions = [("是", "不是"), ("有", "沒有"), ("會", "不會"), ("可以", "不可以"), ("正確", "錯誤"), ("存在", "不存在")]
-        answer_lower = answer.lower()
+    def evaluate_logical_consistency(self, answer: str, pre: Optional[Precomputed] = None) -> float:
+        answer_lower = pre.answer_lower if pre else answer.lower()
         contradiction_count = 0
-        for pos, neg in contradictions:
+        sentences = None
+        for pos, neg in CONTRADICTION_PAIRS:
             if pos in answer_lower and neg in answer_lower:
-                for sentence in re.split(r'[。！？.!?]', answer):
-                    if pos in sentence.lower() and neg in sentence.lower():
-                        contradiction_count += 1
-                        break
+                if sentences is None:
+                    sentences = SENTENCE_SPLIT_PATTERN.split(answer_lower)
+                if any(pos in sentence and neg in sentence for sentence in sentences):
+                    contradiction_count += 1
         if contradiction_count == 0: return 1.0
         elif contradiction_count == 1: return 0.7
         else: return max(0.3, 1.0 - contradiction_count * 0.3)
     
     def evaluate_factual_accuracy(self, context: str, answer: str) -> float:
-        facts = self._extract_facts_from_context(context)
+        facts = extract_facts_from_context(context)
         if not facts: return 0.5
-        accuracy_score = 0.0
-        for fact in facts:
-            if fact in answer: accuracy_score += 1.0
-        return accuracy_score / len(facts) if facts else 0.5
+        found = get_fact_matcher(facts).find_all(answer)
+        accuracy_score = sum(1.0 for fact in facts if fact in found)
+        return accuracy_score / len(facts)
     
-    def evaluate_creativity(self, answer: str, context: str) -> float:
-        context_words = set(self._extract_keywords(context))
-        answer_words = set(self._extract_keywords(answer))
+    def evaluate_creativity(self, answer: str, context: str, pre: Optional[Precomputed] = None) -> float:
+        context_words = extract_keyword_set(context)
+        answer_words = pre.keyword_set if pre else extract_keyword_set(answer)
         if not answer_words: return 0.0
-        unique_words = answer_words - context_words
-        uniqueness = len(unique_words) / len(answer_words)
+        # 交集只走訪較小的集合，且不需建立差集
+        unique_count = len(answer_words) - len(answer_words & context_words)
+        uniqueness = unique_count / len(answer_words)
         creative_indicators = ["可能", "也許", "如果", "假設", "想像", "推測", "可能的原因", "潛在的", "未來可能", "建議"]
-        creativity_bonus = sum(0.1 for ind in creative_indicators if ind in answer.lower())
+        answer_lower = pre.answer_lower if pre else answer.lower()
+        creativity_bonus = sum(0.1 for ind in creative_indicators if ind in answer_lower)
         return min(uniqueness + creativity_bonus, 1.0)
     
-    def evaluate_multilingual_support(self, answer: str, target_language: str = "zh") -> float:
-        total_chars = len(answer.strip())
+    def evaluate_multilingual_support(self, answer: str, target_language: str = "zh",
+                                      pre: Optional[Precomputed] = None) -> float:
+        total_chars = pre.total_chars if pre else len(answer.strip())
         if total_chars == 0: return 0.0
+        if target_language not in ("zh", "en"): return 0.5
+        # 以 UTF-32 碼位陣列計數，避免 re.findall 為每個字元建立字串
+        codepoints = pre.codepoints if pre else to_codepoints(answer)
         if target_language == "zh":
-            lang_chars = len(re.findall(r'[\u4e00-\u9fff]', answer))
-        elif target_language == "en":
-            lang_chars = len(re.findall(r'[a-zA-Z]', answer))
-        else: return 0.5
+            lang_chars = count_cjk_chars(codepoints)
+        else:
+            lang_chars = count_latin_chars(codepoints)
         return min(lang_chars / total_chars * 1.5, 1.0)
     
-    def evaluate_completeness(self, question: str, answer: str) -> float:
-        len_ans = len(answer.strip())
+    def evaluate_completeness(self, question: str, answer: str, pre: Optional[Precomputed] = None) -> float:
+        len_ans = pre.total_chars if pre else len(answer.strip())
         if "?" in question or "？" in question:
             if len_ans < 10: return 0.3
             elif len_ans > 50: return 0.9
@@ -197,30 +349,19 @@ class EnhancedEvaluator:
         elif len_ans > 100: return 0.9
         else: return 0.7
     
-    def evaluate_fluency(self, answer: str) -> float:
-        sentences = re.split(r'[。！？.!?]', answer)
+    def evaluate_fluency(self, answer: str, pre: Optional[Precomputed] = None) -> float:
+        sentences = pre.sentences if pre else SENTENCE_SPLIT_PATTERN.split(answer)
         if not sentences: return 0.0
-        avg_sentence_length = sum(len(s.strip()) for s in sentences) / len(sentences)
-        words = self._extract_keywords(answer)
+        avg_sentence_length = fmean(len(s.strip()) for s in sentences)
+        words = pre.keywords if pre else extract_keywords(answer)
         if not words: return 0.5
-        word_freq = {w: words.count(w) for w in set(words)}
-        repetition_ratio = (max(word_freq.values()) / len(words)) if words else 0
+        word_freq = pre.keyword_counter if pre else Counter(words)
+        max_freq = word_freq.most_common(1)[0][1]
+        repetition_ratio = max_freq / len(words)
         if avg_sentence_length < 5: fluency = 0.3
         elif avg_sentence_length > 50: fluency = 0.6
         else: fluency = 0.8
         return max(0.0, min(1.0, fluency * (1 - repetition_ratio * 0.5)))
-    
-    def _extract_keywords(self, text: str) -> List[str]:
-        text = re.sub(r'[^\w\s]', '', text)
-        words = text.split()
-        stop_words = {'的', '是', '在', '有', '和', '與', '或', '但', '而', 'the', 'is', 'are', 'in', 'on', 'at', 'and', 'or', 'but'}
-        return [word for word in words if len(word) > 1 and word.lower() not in stop_words]
-    
-    def _extract_facts_from_context(self, context: str) -> List[str]:
-        facts = re.findall(r'\d+', context)
-        facts.extend(re.findall(r'[A-Z][a-z]+', context))
-        facts.extend(re.findall(r'[\u4e00-\u9fff]{2,4}', context))
-        return facts[:10]
-
-enhanced_evaluator = EnhancedEvaluator()
-def get_enhanced_evaluator() -> EnhancedEvaluator: return enhanced_evaluator
+
+@lru_cache(maxsize=None)
+def get_enhanced_evaluator() -> EnhancedEvaluator: return EnhancedEvaluator()
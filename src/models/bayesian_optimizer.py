@@ -3,12 +3,46 @@
 import numpy as np
 from typing import Dict, List, Tuple, Callable, Optional, Any
 import logging
-from scipy.stats import norm
+import threading
+from scipy.linalg import cho_solve, solve_triangular
+from scipy.optimize import minimize
+from scipy.stats import qmc
+from scipy.special import erfcx, ndtr
 from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF, ConstantKernel as C
+from sklearn.gaussian_process.kernels import RBF, ConstantKernel as C, Product
 import warnings
 warnings.filterwarnings('ignore')
 
+_INV_SQRT_2PI = 1.0 / np.sqrt(2.0 * np.pi)
+_LOG_SQRT_2PI = 0.5 * np.log(2.0 * np.pi)
+_SQRT_HALF_PI = np.sqrt(np.pi / 2.0)
+_LOG_EI_ASYMPTOTIC_Z = -1.0 / np.sqrt(np.finfo(float).eps)
+# 每新增這麼多筆觀測才重新最佳化核函數超參數，其餘時候以 Cholesky 分塊更新延伸既有的分解
+HYPERPARAM_REFIT_INTERVAL = 5
+
+def _normal_pdf(z: np.ndarray) -> np.ndarray:
+    # 標準常態分佈的機率密度；與 scipy.special.ndtr 搭配，省去 scipy.stats.norm 每次呼叫的分派開銷
+    return np.exp(-0.5 * z * z) * _INV_SQRT_2PI
+
+def _log_h(z: np.ndarray) -> np.ndarray:
+    """
+    數值穩定地計算 log(z·Φ(z) + φ(z))。z 很負時 EI 本身會下溢為 0，
+    改以 φ(z)·(1 + z·Φ(z)/φ(z)) 並用 erfcx 表示 Mills ratio，極端情況再用漸近式。
+    """
+    z = np.asarray(z, dtype=float)
+    result = np.empty_like(z)
+    upper = z > -1
+    middle = ~upper & (z > _LOG_EI_ASYMPTOTIC_Z)
+    lower = ~upper & ~middle
+    z_upper = z[upper]
+    result[upper] = np.log(z_upper * ndtr(z_upper) + _normal_pdf(z_upper))
+    z_middle = z[middle]
+    result[middle] = (-0.5 * z_middle * z_middle - _LOG_SQRT_2PI
+                      + np.log1p(z_middle * _SQRT_HALF_PI * erfcx(-z_middle / np.sqrt(2.0))))
+    z_lower = z[lower]
+    result[lower] = -0.5 * z_lower * z_lower - _LOG_SQRT_2PI - 2.0 * np.log(np.abs(z_lower))
+    return result
+
 class BayesianOptimizer:
     def __init__(self, param_bounds: Dict[str, Tuple[float, float]], 
                  n_initial_points: int = 5, n_iterations: int = 20,
@@ -18,7 +52,7 @@ class BayesianOptimizer:
             param_bounds: 參數邊界，格式為 {'param_name': (min_val, max_val)}
             n_initial_points: 初始隨機點數量
             n_iterations: 優化迭代次數
-            acquisition_function: 採集函數類型 ('ei', 'pi', 'ucb')
+            acquisition_function: 採集函數類型 ('ei', 'logei', 'pi', 'ucb')
         """
         self.param_bounds = param_bounds
         self.n_initial_points = n_initial_points
@@ -26,70 +60,163 @@ class BayesianOptimizer:
         self.acquisition_function = acquisition_function
         
         self.param_names = list(param_bounds.keys())
-        self.bounds_array = np.array([param_bounds[name] for name in self.param_names])
-        self.X = []
-        self.y = [] 
+        self.bounds_array = np.array([param_bounds[name] for name in self.param_names], dtype=float).reshape(-1, 2)
+        self._lo = self.bounds_array[:, 0]
+        self._scale = self.bounds_array[:, 1] - self._lo
+        # 觀測值存放在預先配置的矩陣中，容量不足時倍增，避免每次擬合都從 list 重建陣列
+        capacity = max(1, n_initial_points + n_iterations)
+        self._X_mat = np.empty((capacity, len(self.param_names)))
+        self._y_vec = np.empty(capacity)
+        # 標記只評估了部分項目（例如被剪枝）的觀測，這些評分只提供給 GP，不代表完整結果
+        self._partial_vec = np.zeros(capacity, dtype=bool)
+        self._n = 0
         self.best_score = -np.inf
         self.best_params = None
         kernel = C(1.0, (1e-3, 1e3)) * RBF([1.0] * len(self.param_names), (1e-2, 1e2))
         self.gp = GaussianProcessRegressor(kernel=kernel, alpha=1e-6, normalize_y=True)
+        # 初始點改用打亂的 Sobol 低差異序列，同樣點數下比獨立均勻抽樣更均勻地覆蓋參數空間
+        self._init_samples = np.empty((0, len(self.param_names)))
+        if n_initial_points > 0 and self.param_names:
+            sobol = qmc.Sobol(d=len(self.param_names), scramble=True)
+            self._init_samples = sobol.random_base2(m=int(np.ceil(np.log2(n_initial_points))))[:n_initial_points]
+        self._init_counter = 0
+        self._n_fitted = 0
+        self._n_hyperparam_fitted = 0
+        self._L_inv_cache = (None, None)
+        self._rbf_cache = (None, None)
         
         self.logger = logging.getLogger(__name__)
+    
+    @property
+    def X(self) -> np.ndarray:
+        return self._X_mat[:self._n]
+    
+    @property
+    def y(self) -> np.ndarray:
+        return self._y_vec[:self._n]
+    
+    def _append_observation(self, X_normalized: np.ndarray, score: float, partial: bool = False):
+        if self._n == len(self._y_vec):
+            self._X_mat = np.concatenate([self._X_mat, np.empty_like(self._X_mat)])
+            self._y_vec = np.concatenate([self._y_vec, np.empty_like(self._y_vec)])
+            self._partial_vec = np.concatenate([self._partial_vec, np.zeros_like(self._partial_vec)])
+        self._X_mat[self._n] = X_normalized
+        self._y_vec[self._n] = score
+        self._partial_vec[self._n] = partial
+        self._n += 1
         
     def _normalize_params(self, params: Dict[str, float]) -> np.ndarray:
-        normalized = []
-        for name in self.param_names:
-            min_val, max_val = self.param_bounds[name]
-            val = params[name]
-            normalized_val = (val - min_val) / (max_val - min_val)
-            normalized.append(normalized_val)
-        return np.array(normalized)
+        values = np.fromiter((params[name] for name in self.param_names), float, len(self.param_names))
+        return (values - self._lo) / self._scale
     
     def _denormalize_params(self, normalized_params: np.ndarray) -> Dict[str, float]:
-        params = {}
-        for i, name in enumerate(self.param_names):
-            min_val, max_val = self.param_bounds[name]
-            normalized_val = normalized_params[i]
-            val = min_val + normalized_val * (max_val - min_val)
-            params[name] = val
-        return params
+        return dict(zip(self.param_names, self._lo + np.asarray(normalized_params) * self._scale))
     
     def _generate_random_params(self) -> Dict[str, float]:
+        if self._init_counter < len(self._init_samples):
+            self._init_counter += 1
+            return self._denormalize_params(self._init_samples[self._init_counter - 1])
+        
         params = {}
         for name in self.param_names:
             min_val, max_val = self.param_bounds[name]
             params[name] = np.random.uniform(min_val, max_val)
         return params
     
+    def _get_L_inv(self, L: np.ndarray) -> np.ndarray:
+        # 每個 Cholesky 因子只求一次反矩陣，之後的標準差計算以矩陣乘法取代逐次的三角求解
+        cached_L, L_inv = self._L_inv_cache
+        if cached_L is not L:
+            L_inv = solve_triangular(L, np.eye(len(L)), lower=True, check_finite=False)
+            self._L_inv_cache = (L, L_inv)
+        return L_inv
+    
+    def _kernel_with_train(self, gp: GaussianProcessRegressor, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        計算 K(X, X_train) 與 K(X, X) 的對角線。核函數為 ConstantKernel * RBF 時，
+        以 ||x-y||² = ||x||² + ||y||² - 2<x,y> 展開，交叉項只需一次矩陣乘法；
+        依長度尺度縮放後的訓練資料與其平方範數在每次擬合後只計算一次。
+        """
+        kernel = gp.kernel_
+        if not (isinstance(kernel, Product) and isinstance(kernel.k1, C) and isinstance(kernel.k2, RBF)):
+            return kernel(X, gp.X_train_), kernel.diag(X)
+        
+        cached_X_train, params = self._rbf_cache
+        if cached_X_train is not gp.X_train_ or params[0] is not kernel:
+            length_scale = np.asarray(kernel.k2.length_scale, dtype=float)
+            scaled_train = gp.X_train_ / length_scale
+            params = (kernel, length_scale, scaled_train.T.copy(),
+                      -0.5 * np.einsum('ij,ij->i', scaled_train, scaled_train), kernel.k1.constant_value)
+            self._rbf_cache = (gp.X_train_, params)
+        _, length_scale, scaled_train_T, half_sq_train, constant = params
+        
+        scaled = X / length_scale
+        exponent = scaled @ scaled_train_T
+        exponent -= 0.5 * np.einsum('ij,ij->i', scaled, scaled)[:, None]
+        exponent += half_sq_train
+        np.minimum(exponent, 0.0, out=exponent)
+        np.exp(exponent, out=exponent)
+        exponent *= constant
+        return exponent, np.full(len(X), constant)
+    
+    def _fast_predict(self, X: np.ndarray, return_std: bool = True):
+        """
+        直接使用已擬合 GP 的 Cholesky 因子 L_ 與 alpha_ 計算後驗均值與標準差，
+        省去 sklearn predict 每次呼叫的輸入驗證與分派開銷（結果與 gp.predict 相同）。
+        均值與標準差共用同一個 K_trans，標準差只需一次與快取 L⁻¹ 的矩陣乘法。
+        """
+        gp = self.gp
+        if not hasattr(gp, 'L_') or not hasattr(gp, '_y_train_std'):
+            return gp.predict(X, return_std=return_std)
+        K_trans, K_diag = self._kernel_with_train(gp, X)
+        mu = (K_trans @ gp.alpha_) * gp._y_train_std + gp._y_train_mean
+        if not return_std:
+            return mu
+        v = self._get_L_inv(gp.L_) @ K_trans.T
+        variance = K_diag - np.einsum('ij,ij->j', v, v)
+        sigma = np.sqrt(np.maximum(variance, 0.0)) * gp._y_train_std
+        return mu, sigma
+    
     def _expected_improvement(self, X: np.ndarray, xi: float = 0.01) -> np.ndarray:
-        mu, sigma = self.gp.predict(X, return_std=True)
+        mu, sigma = self._fast_predict(X)
         sigma = np.maximum(sigma, 1e-8)
         
         improvement = mu - self.best_score - xi
         Z = improvement / sigma
-        ei = improvement * norm.cdf(Z) + sigma * norm.pdf(Z)
+        ei = improvement * ndtr(Z) + sigma * _normal_pdf(Z)
         ei[sigma == 0.0] = 0.0
         
         return ei
     
+    def _log_expected_improvement(self, X: np.ndarray, xi: float = 0.01) -> np.ndarray:
+        """
+        log(EI)：在模型確信表現不佳的區域 EI 會下溢為 0 而失去梯度，取對數後仍可比較大小。
+        """
+        mu, sigma = self._fast_predict(X)
+        sigma = np.maximum(sigma, 1e-8)
+        Z = (mu - self.best_score - xi) / sigma
+        return _log_h(Z) + np.log(sigma)
+    
     def _probability_improvement(self, X: np.ndarray, xi: float = 0.01) -> np.ndarray:
-        mu, sigma = self.gp.predict(X, return_std=True)
+        mu, sigma = self._fast_predict(X)
         sigma = np.maximum(sigma, 1e-8)
         
         improvement = mu - self.best_score - xi
         Z = improvement / sigma
-        pi = norm.cdf(Z)
+        pi = ndtr(Z)
         
         return pi
     
     def _upper_confidence_bound(self, X: np.ndarray, kappa: float = 2.0) -> np.ndarray:
-        mu, sigma = self.gp.predict(X, return_std=True)
+        mu, sigma = self._fast_predict(X)
         ucb = mu + kappa * sigma
         return ucb
     
     def _acquisition_function_value(self, X: np.ndarray) -> np.ndarray:
         if self.acquisition_function == 'ei':
             return self._expected_improvement(X)
+        elif self.acquisition_function == 'logei':
+            return self._log_expected_improvement(X)
         elif self.acquisition_function == 'pi':
             return self._probability_improvement(X)
         elif self.acquisition_function == 'ucb':
@@ -97,25 +224,37 @@ class BayesianOptimizer:
         else:
             raise ValueError(f"不支援的採集函數: {self.acquisition_function}")
     
-    def _optimize_acquisition(self, n_restarts: int = 10) -> Dict[str, float]:
-        best_acq = -np.inf
-        best_params = None
-        
-        for _ in range(n_restarts):
-            x0 = np.random.uniform(0, 1, len(self.param_names))
-            for _ in range(50):
-                x_candidate = x0 + np.random.normal(0, 0.1, len(self.param_names))
-                x_candidate = np.clip(x_candidate, 0, 1)
-                
-                acq_val = self._acquisition_function_value(x_candidate.reshape(1, -1))[0]
-                
-                if acq_val > best_acq:
-                    best_acq = acq_val
-                    best_params = x_candidate.copy()
-                    x0 = x_candidate.copy()
-        
-        if best_params is None:
-            best_params = np.random.uniform(0, 1, len(self.param_names))
+    def _optimize_acquisition(self, n_restarts: int = 10, n_steps: int = 50, n_polish: int = 3) -> Dict[str, float]:
+        """
+        從 n_restarts 個隨機起點各走 n_steps 步隨機漫步，所有候選點一次送入 GP 計算採集函數值，
+        再以採集函數值最高的 n_polish 個候選點為起點執行 L-BFGS-B 做局部最佳化。
+        """
+        n_dims = len(self.param_names)
+        starts = np.random.uniform(0, 1, (n_restarts, 1, n_dims))
+        steps = np.random.normal(0, 0.1, (n_restarts, n_steps, n_dims))
+        candidates = np.clip(starts + steps.cumsum(axis=1), 0, 1).reshape(-1, n_dims)
+        
+        acq_values = self._acquisition_function_value(candidates)
+        if not np.isfinite(acq_values).any():
+            return self._denormalize_params(np.random.uniform(0, 1, n_dims))
+        
+        acq_values = np.nan_to_num(acq_values, nan=-np.inf)
+        best_index = int(np.argmax(acq_values))
+        best_params, best_acq = candidates[best_index], acq_values[best_index]
+        
+        def negative_acquisition(x: np.ndarray) -> float:
+            return -float(self._acquisition_function_value(x.reshape(1, -1))[0])
+        
+        for index in np.argsort(acq_values)[len(acq_values) - n_polish:]:
+            try:
+                result = minimize(negative_acquisition, candidates[index], method='L-BFGS-B',
+                                  bounds=[(0, 1)] * n_dims, options={'maxiter': 20})
+            except Exception as e:
+                self.logger.debug(f"L-BFGS-B 最佳化失敗: {e}")
+                continue
+            if np.isfinite(result.fun) and -result.fun > best_acq:
+                best_acq = -result.fun
+                best_params = np.clip(result.x, 0, 1)
         
         return self._denormalize_params(best_params)
     
@@ -125,23 +264,166 @@ class BayesianOptimizer:
         else:
             return self._optimize_acquisition()
     
-    def update(self, params: Dict[str, float], score: float):
+    def suggest_next_batch(self, k: int, pending: Optional[List[Dict[str, float]]] = None,
+                           strategy: str = 'kb') -> List[Dict[str, float]]:
+        """
+        一次建議 k 個參數點：每選出一點就加入假想觀測，用固定核函數的 GP 重新擬合
+        後再選下一點，避免整批擠在同一處。
+        
+        Args:
+            k: 建議的參數點數量
+            pending: 已送出評估但尚未有結果的參數點，同樣加入假想觀測
+            strategy: 假想觀測的取值方式；'kb'（Kriging Believer）使用 GP 預測均值，
+                      'cl_min'（Constant Liar）使用目前最差的觀測值，批次會分散得更開
+            
+        Returns:
+            參數組合列表
+        """
+        if len(self.X) < self.n_initial_points:
+            return [self._generate_random_params() for _ in range(k)]
+        
+        if strategy not in ('kb', 'cl_min'):
+            raise ValueError(f"不支援的批次策略: {strategy}")
+        
+        fitted_gp = self.gp
+        X_fantasy = list(self.X)
+        y_fantasy = list(self.y)
+        liar = min(self.y)
+        batch = []
+        
+        def add_fantasies(points: List[Dict[str, float]]):
+            for params in points:
+                X_normalized = self._normalize_params(params)
+                X_fantasy.append(X_normalized)
+                if strategy == 'cl_min':
+                    y_fantasy.append(liar)
+                else:
+                    y_fantasy.append(self._fast_predict(X_normalized.reshape(1, -1), return_std=False)[0])
+            # 固定已擬合的核函數超參數，只做一次 Cholesky 分解而不重新最佳化
+            fantasy_gp = GaussianProcessRegressor(kernel=fitted_gp.kernel_, optimizer=None,
+                                                  alpha=fitted_gp.alpha, normalize_y=True)
+            fantasy_gp.fit(np.array(X_fantasy), np.array(y_fantasy))
+            self.gp = fantasy_gp
+        
+        try:
+            if pending:
+                add_fantasies(pending)
+            batch.append(self._optimize_acquisition())
+            for _ in range(k - 1):
+                add_fantasies(batch[-1:])
+                batch.append(self._optimize_acquisition())
+        finally:
+            self.gp = fitted_gp
+        return batch
+    
+    def refit(self):
+        n = len(self.X)
+        if n < 2 or n == self._n_fitted:
+            return
+        
+        if 0 < self._n_fitted < n and n - self._n_hyperparam_fitted < HYPERPARAM_REFIT_INTERVAL:
+            try:
+                self._extend_cholesky()
+                return
+            except np.linalg.LinAlgError:
+                self.logger.debug("Cholesky 分塊更新失敗，改為完整重新擬合")
+        
+        self.gp.fit(self.X, self.y)
+        self._n_fitted = n
+        self._n_hyperparam_fitted = n
+    
+    def _extend_cholesky(self):
+        """
+        沿用已擬合的核函數超參數，將新觀測以分塊 Cholesky 更新加入 GP，
+        成本為 O(N²m) 而非重新擬合的 O(N³)（m 為新增的觀測數）。
+        """
+        gp = self.gp
+        n_old = self._n_fitted
+        X = self.X.copy()
+        y = self.y.copy()
+        X_old, X_new = X[:n_old], X[n_old:]
+        
+        K_cross = gp.kernel_(X_old, X_new)
+        K_new = gp.kernel_(X_new)
+        K_new[np.diag_indices_from(K_new)] += gp.alpha
+        U = solve_triangular(gp.L_, K_cross, lower=True, check_finite=False)
+        L_new = np.linalg.cholesky(K_new - U.T @ U)
+        
+        L = np.zeros((len(X), len(X)))
+        L[:n_old, :n_old] = gp.L_
+        L[n_old:, :n_old] = U.T
+        L[n_old:, n_old:] = L_new
+        
+        # normalize_y 的均值與標準差隨新觀測改變，需以新的標準化目標重算 alpha_
+        y_mean = np.mean(y)
+        y_std = np.std(y)
+        if y_std < 10 * np.finfo(float).eps:
+            y_std = 1.0
+        y_train = (y - y_mean) / y_std
+        
+        gp.X_train_ = X
+        gp.y_train_ = y_train
+        gp._y_train_mean = y_mean
+        gp._y_train_std = y_std
+        gp.L_ = L
+        gp.alpha_ = cho_solve((L, True), y_train, check_finite=False)
+        self._n_fitted = len(X)
+    
+    def update(self, params: Dict[str, float], score: float, refit: bool = True, partial: bool = False):
         """     
         Args:
             params: 測試的參數組合
             score: 獲得的評分
+            refit: 是否立即重新擬合 GP；批次更新時可設為 False，最後再呼叫 refit()
+            partial: 評分是否只來自部分評估項目（例如被剪枝的試驗）；此類評分不會成為最佳結果
         """
         X_normalized = self._normalize_params(params)
-        self.X.append(X_normalized)
-        self.y.append(score)
-        if score > self.best_score:
+        self._append_observation(X_normalized, score, partial)
+        if not partial and score > self.best_score:
             self.best_score = score
             self.best_params = params.copy()
             self.logger.info(f"發現新的最佳結果: {score:.4f} with params: {params}")
-        if len(self.X) >= 2:
-            X_array = np.array(self.X)
-            y_array = np.array(self.y)
-            self.gp.fit(X_array, y_array)
+        if refit:
+            self.refit()
+    
+    def seed(self, observations: List[Tuple[Dict[str, float], float]]) -> int:
+        """
+        以先前的觀測結果暖啟動高斯過程，已存在的參數點會被略過。
+        
+        Args:
+            observations: (參數組合, 評分) 列表
+            
+        Returns:
+            實際加入的觀測數量
+        """
+        added = 0
+        for params, score in observations:
+            if any(name not in params for name in self.param_names):
+                continue
+            X_normalized = self._normalize_params(params)
+            if np.isclose(self.X, X_normalized).all(axis=1).any():
+                continue
+            self._append_observation(X_normalized, score)
+            if score > self.best_score:
+                self.best_score = score
+                self.best_params = {name: params[name] for name in self.param_names}
+            added += 1
+        if added:
+            self.refit()
+        return added
+    
+    def get_observations(self, include_partial: bool = False) -> List[Tuple[Dict[str, float], float]]:
+        """
+        Args:
+            include_partial: 是否包含只評估了部分項目（例如被剪枝）的觀測
+
+        Returns:
+            (參數組合, 評分) 列表
+        """
+        partial = self._partial_vec[:self._n]
+        return [({name: float(value) for name, value in self._denormalize_params(x).items()}, float(score))
+                for x, score, is_partial in zip(self.X, self.y, partial)
+                if include_partial or not is_partial]
     
     def get_best_result(self) -> Tuple[Dict[str, float], float]:
         return self.best_params, self.best_score
@@ -186,26 +468,33 @@ class BayesianOptimizer:
 class AdaptiveBayesianOptimizer(BayesianOptimizer):
     def __init__(self, param_bounds: Dict[str, Tuple[float, float]], 
                  n_initial_points: int = 5, n_iterations: int = 20,
-                 early_stopping_patience: int = 5, improvement_threshold: float = 0.01):
+                 early_stopping_patience: int = 5, improvement_threshold: float = 0.01,
+                 acquisition_function: str = 'ei'):
         """
         Args:
             early_stopping_patience: 早停耐心值
             improvement_threshold: 改進閾值
+            acquisition_function: 採集函數類型 ('ei', 'logei', 'pi', 'ucb')
         """
-        super().__init__(param_bounds, n_initial_points, n_iterations)
+        super().__init__(param_bounds, n_initial_points, n_iterations, acquisition_function)
         self.early_stopping_patience = early_stopping_patience
         self.improvement_threshold = improvement_threshold
         self.no_improvement_count = 0
         self.last_best_score = -np.inf
         
-    def update(self, params: Dict[str, float], score: float):
-        super().update(params, score)
-        if score > self.last_best_score + self.improvement_threshold:
+    def update(self, params: Dict[str, float], score: float, refit: bool = True, partial: bool = False):
+        super().update(params, score, refit, partial)
+        if not partial and score > self.last_best_score + self.improvement_threshold:
             self.no_improvement_count = 0
             self.last_best_score = score
         else:
             self.no_improvement_count += 1
     
+    def seed(self, observations: List[Tuple[Dict[str, float], float]]) -> int:
+        added = super().seed(observations)
+        self.last_best_score = max(self.last_best_score, self.best_score)
+        return added
+    
     def should_stop_early(self) -> bool:
         return self.no_improvement_count >= self.early_stopping_patience
     
@@ -218,6 +507,48 @@ class AdaptiveBayesianOptimizer(BayesianOptimizer):
         if self.should_stop_early():
             return None
         return super().suggest_next_point()
+    
+    def suggest_next_batch(self, k: int, pending: Optional[List[Dict[str, float]]] = None,
+                           strategy: str = 'kb') -> List[Dict[str, float]]:
+        if self.should_stop_early():
+            return []
+        return super().suggest_next_batch(k, pending, strategy)
+
+class MedianPruner:
+    def __init__(self, n_startup_trials: int = 5, n_warmup_steps: int = 2):
+        """
+        Args:
+            n_startup_trials: 完成的試驗數少於此值時不剪枝
+            n_warmup_steps: 每次試驗的前幾步不剪枝
+        """
+        self.n_startup_trials = n_startup_trials
+        self.n_warmup_steps = n_warmup_steps
+        self.completed_trials = []
+        # 同一批次的多個試驗會在不同執行緒中同時查詢與回報
+        self._lock = threading.Lock()
+
+    def should_prune(self, step: int, value: float) -> bool:
+        """
+        Args:
+            step: 目前步數（從 0 開始）；第 step 步的中間評分須固定涵蓋前 step + 1 個評估項目，不同試驗才可比較
+            value: 目前步數的中間評分
+
+        Returns:
+            中間評分低於已完成試驗在同一步的中位數時返回 True
+        """
+        with self._lock:
+            completed_trials = list(self.completed_trials)
+        if len(completed_trials) < self.n_startup_trials or step < self.n_warmup_steps:
+            return False
+        step_values = [trial[step] for trial in completed_trials if len(trial) > step]
+        if not step_values:
+            return False
+        return value < np.median(step_values)
+
+    def complete_trial(self, intermediate_values: List[float]):
+        with self._lock:
+            self.completed_trials.append(list(intermediate_values))
+
 DEFAULT_PARAM_BOUNDS = {
     'temperature': (0.1, 1.5),
     'top_p': (0.5, 1.0),
@@ -230,5 +561,9 @@ def create_optimizer_for_quality_tuning() -> AdaptiveBayesianOptimizer:
         n_initial_points=8,
         n_iterations=25,
         early_stopping_patience=5,
-        improvement_threshold=0.02
+        improvement_threshold=0.02,
+        acquisition_function='logei'
     )
+
+def create_pruner_for_quality_tuning() -> MedianPruner:
+    return MedianPruner(n_startup_trials=5, n_warmup_steps=2)
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import threading
 from flask import Flask, render_template, jsonify, request
 from flask_socketio import SocketIO, emit
 import logging
-from typing import Dict, Any, List
+from collections import deque
+from typing import Dict, Any, List, Callable
+
+# 高頻率的日誌、記憶體與緩存更新會先暫存，有新內容時再等這段時間合併送出
+EMIT_INTERVAL_SECONDS = 0.1
 
 
 class WebInterface:
@@ -19,20 +24,36 @@ class WebInterface:
         self.socketio = SocketIO(self.app, async_mode='threading')
         self.logger = logging.getLogger(__name__)
         self.status = {'state': 'idle', 'message': '等待開始'}
-        self.log_messages = []
+        self.log_messages = deque(maxlen=100)
         self.memory_usage = {}
         self.cache_stats = {}
         self.tuning_results = []
         self.available_models = []
+        # 日誌與事件依產生順序排在同一個序列，連續的日誌合併成一筆 log_update
+        self._pending_items = []
+        self._pending_log_count = 0
+        self._pending_updates = {}
+        self._emit_lock = threading.Lock()
+        self._emitter_started = False
+        # 有待送出的內容時才喚醒 emitter，閒置時不必定期輪詢
+        self._emit_wakeup = threading.Event()
+        self._client_listeners = []
         self._register_routes()
         self._register_socketio_events()
 
+    def add_client_listener(self, listener: Callable[[bool], None]):
+        """
+        Args:
+            listener: 客戶端連線時以 True、斷線時以 False 呼叫
+        """
+        self._client_listeners.append(listener)
+
     def set_available_models(self, models: List[str]):
         self.available_models = models
         self.logger.info("Broadcasting available_models event with data: %s", {
                          'models': self.available_models})
-        self.socketio.emit('available_models', {
-                           'models': self.available_models})
+        self.emit_event('available_models', {
+                        'models': self.available_models})
 
     def _register_routes(self):
         def _load_translations(lang: str) -> dict:
@@ -66,8 +87,13 @@ class WebInterface:
         @self.socketio.on('connect')
         def handle_connect():
             self.logger.info("Web UI 客戶端已連接")
+            for listener in self._client_listeners:
+                listener(True)
             emit('status_update', self.status)
-            emit('log_update', self.log_messages)
+            with self._emit_lock:
+                # 尚未送出的日誌會由下一次合併送出補上，這裡略過以免重複
+                history = list(self.log_messages)[:max(0, len(self.log_messages) - self._pending_log_count)]
+            emit('log_update', history)
             emit('memory_update', self.memory_usage)
             emit('cache_update', self.cache_stats)
             emit('results_update', self.tuning_results)
@@ -76,6 +102,8 @@ class WebInterface:
         @self.socketio.on('disconnect')
         def handle_disconnect():
             self.logger.info("Web UI 客戶端已斷開")
+            for listener in self._client_listeners:
+                listener(False)
 
         @self.socketio.on('start_tuning')
         def handle_start_tuning(data): pass
@@ -90,29 +118,76 @@ class WebInterface:
         self.socketio.run(self.app, host=host, port=port,
                           debug=debug, allow_unsafe_werkzeug=True)
 
+    def _ensure_emitter(self):
+        with self._emit_lock:
+            start = not self._emitter_started
+            self._emitter_started = True
+        self._emit_wakeup.set()
+        if start:
+            self.socketio.start_background_task(self._emit_pending_loop)
+
+    def _emit_pending_loop(self):
+        while True:
+            self._emit_wakeup.wait()
+            # 喚醒後再等一小段時間，合併這段期間陸續排入的內容一起送出
+            self.socketio.sleep(EMIT_INTERVAL_SECONDS)
+            self._emit_wakeup.clear()
+            self._flush_pending()
+
+    def _flush_pending(self):
+        with self._emit_lock:
+            items, self._pending_items = self._pending_items, []
+            self._pending_log_count = 0
+            updates, self._pending_updates = self._pending_updates, {}
+        for event, data in items:
+            self.socketio.emit(event, data)
+        for event, data in updates.items():
+            self.socketio.emit(event, data)
+
+    def _queue_update(self, event: str, data: Dict[str, Any]):
+        with self._emit_lock:
+            self._pending_updates[event] = data
+        self._ensure_emitter()
+
+    def emit_event(self, event: str, data: Dict[str, Any]):
+        """
+        交由背景 emitter 依序送出，不會被合併；其他執行緒不直接呼叫 socketio.emit
+
+        Args:
+            event: Socket.IO 事件名稱
+            data: 事件內容
+        """
+        with self._emit_lock:
+            self._pending_items.append((event, data))
+        self._ensure_emitter()
+
     def set_status(self, state: str, message: str):
         self.status = {'state': state, 'message': message}
-        self.socketio.emit('status_update', self.status)
+        self.emit_event('status_update', self.status)
         self.add_log_message('info', message)
 
     def add_log_message(self, level: str, message: str):
         log_entry = {'level': level, 'message': message}
-        self.log_messages.append(log_entry)
-        if len(self.log_messages) > 100:
-            self.log_messages.pop(0)
-        self.socketio.emit('log_update', [log_entry])
+        with self._emit_lock:
+            self.log_messages.append(log_entry)
+            if self._pending_items and self._pending_items[-1][0] == 'log_update':
+                self._pending_items[-1][1].append(log_entry)
+            else:
+                self._pending_items.append(('log_update', [log_entry]))
+            self._pending_log_count += 1
+        self._ensure_emitter()
 
     def update_memory_usage(self, data: Dict[str, Any]):
         self.memory_usage = data
-        self.socketio.emit('memory_update', self.memory_usage)
+        self._queue_update('memory_update', data)
 
     def update_cache_stats(self, data: Dict[str, Any]):
         self.cache_stats = data
-        self.socketio.emit('cache_update', self.cache_stats)
+        self._queue_update('cache_update', data)
 
     def add_tuning_result(self, result: Dict[str, Any]):
         self.tuning_results.append(result)
-        self.socketio.emit('new_result', result)
+        self.emit_event('new_result', result)
 
 
 web_ui = WebInterface()
@@ -1,38 +1,276 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import json
+import math
 import os
+import atexit
 import hashlib
+import tempfile
 import time
-from typing import Dict, Any, Optional, List
+import numbers
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Mapping, Tuple, Iterator
 from datetime import datetime, timedelta
 import logging
+import numpy as np
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+INDEX_FILENAME = "_index.json"
+INDEX_FLUSH_INTERVAL = 20
+
+def _normalize_key_value(value: Any) -> Any:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        return float(value)
+    return value
+
+def make_cache_key(parameters: Mapping[str, Any]) -> Tuple:
+    """
+    Args:
+        parameters: 測試參數（非基本型別的值，例如詳細評估結果字典，會被忽略）
+        
+    Returns:
+        依鍵排序的 (鍵, 值) tuple，可直接作為緩存鍵
+    """
+    return tuple(sorted(
+        (key, _normalize_key_value(value)) for key, value in parameters.items()
+        if isinstance(value, (numbers.Number, str)) and not isinstance(value, complex)
+    ))
+
+@lru_cache(maxsize=4096)
+def _hash_cache_key(model_name: str, key: Tuple) -> str:
+    # blake2b 為標準函式庫內建，短字串雜湊比 OpenSSL 的 md5 快；16 位元組摘要與原本的檔名長度相同
+    return hashlib.blake2b(f"{model_name}:{key!r}".encode('utf-8'), digest_size=16).hexdigest()
+
+def _loads_json(raw: bytes) -> Any:
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            # 含 Infinity / NaN 的內容由 json 模組寫入，orjson 無法解析
+            pass
+    return json.loads(raw)
+
+def _load_json(path: str) -> Any:
+    with open(path, 'rb') as f:
+        return _loads_json(f.read())
+
+def _has_non_finite(data: Any) -> bool:
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, (float, np.floating)):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, np.ndarray) and value.dtype.kind == 'f':
+            if not np.isfinite(value).all():
+                return True
+    return False
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _dump_json(data: Any, indent: bool = False) -> bytes:
+    """
+    Args:
+        data: 要序列化的資料（可包含 numpy 數值）
+        indent: 是否以兩格縮排輸出
+        
+    Returns:
+        UTF-8 編碼的 JSON
+    """
+    # orjson 會把 inf / NaN 寫成 null（例如失敗探測的 (inf, 0, inf)），讀回後無法再比較或格式化；
+    # 含非有限值時改用 json 模組，保留 Infinity / NaN
+    if ORJSON_AVAILABLE and not _has_non_finite(data):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+    return json.dumps(data, indent=2 if indent else None, ensure_ascii=False,
+                      default=_json_default).encode('utf-8')
+
+def _atomic_write(path: str, payload: bytes):
+    # 先寫入同目錄的暫存檔再以 os.replace 取代，讀取端不會看到寫到一半的檔案
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _as_float(value: Any) -> float:
+    # 非數值參數填入 NaN，向量比較時必定不相似，與原本 val1 != val2 的判斷一致
+    if isinstance(value, numbers.Real):
+        return float(value)
+    return np.nan
 
 class CacheManager:
-    def __init__(self, cache_dir: str = ".cache", max_age_hours: int = 24):
+    def __init__(self, cache_dir: str = ".cache", max_age_hours: int = 24, memory_cache_size: int = 1024):
         """
         Args:
             cache_dir: 緩存目錄
             max_age_hours: 緩存最大保存時間（小時）
+            memory_cache_size: 記憶體內 LRU 快取的最大筆數，命中時不必再讀檔與解析 JSON
         """
         self.cache_dir = cache_dir
         self.max_age_hours = max_age_hours
+        self.memory_cache_size = memory_cache_size
+        self._memory_cache = OrderedDict()
+        self._memory_cache_lock = threading.Lock()
+        # 索引記錄每個緩存檔的模型、時間戳與參數，統計、清理與相似搜尋只需掃描記憶體
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._index_lock = threading.Lock()
+        self._index_pending_writes = 0
+        self._index_version = 0
+        # (模型, 參數鍵) -> (索引版本, 緩存鍵列表, 參數列表, (N, d) 參數矩陣)，索引變動後才重建
+        self._param_matrices: Dict[Tuple[str, Tuple[str, ...]], Tuple[int, List[str], List[Dict], np.ndarray]] = {}
+        self._index_path = os.path.join(cache_dir, INDEX_FILENAME)
         self.logger = logging.getLogger(__name__)
         os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
         self._cleanup_expired_cache()
+        atexit.register(self.flush_index)
     
-    def _generate_cache_key(self, model_name: str, parameters: Dict[str, Any]) -> str:
-        param_str = json.dumps(parameters, sort_keys=True)
-        hash_obj = hashlib.md5()
-        hash_obj.update(f"{model_name}:{param_str}".encode('utf-8'))
-        
-        return hash_obj.hexdigest()
+    def _generate_cache_key(self, model_name: str, key: Tuple) -> str:
+        return _hash_cache_key(model_name, key)
+    
+    def _memory_get(self, cache_key: str) -> Optional[Dict]:
+        with self._memory_cache_lock:
+            entry = self._memory_cache.get(cache_key)
+            if entry is None:
+                return None
+            stored_at, _, encoded = entry
+            if time.time() - stored_at >= self.max_age_hours * 3600:
+                del self._memory_cache[cache_key]
+                return None
+            self._memory_cache.move_to_end(cache_key)
+        # 每次命中都解碼出新的物件：呼叫端修改結果不會影響快取，型別也與從檔案讀取時一致（tuple 讀回為 list）
+        return _loads_json(encoded)
+    
+    def _memory_set(self, cache_key: str, model_name: str, result: Optional[Dict], stored_at: float):
+        # 只保存序列化後的內容，不保留呼叫端物件的參照
+        encoded = _dump_json(result)
+        with self._memory_cache_lock:
+            self._memory_cache[cache_key] = (stored_at, model_name, encoded)
+            self._memory_cache.move_to_end(cache_key)
+            while len(self._memory_cache) > self.memory_cache_size:
+                self._memory_cache.popitem(last=False)
     
     def _get_cache_file_path(self, cache_key: str) -> str:
         return os.path.join(self.cache_dir, f"{cache_key}.json")
     
+    def _read_cache_file(self, cache_key: str) -> Optional[Dict]:
+        try:
+            return _load_json(self._get_cache_file_path(cache_key))
+        except Exception:
+            return None
+    
+    def _index_set(self, cache_key: str, cache_data: Dict, size: int):
+        with self._index_lock:
+            self._index[cache_key] = {
+                'model_name': cache_data.get('model_name', 'unknown'),
+                'timestamp': cache_data.get('timestamp'),
+                'parameters': cache_data.get('parameters', {}),
+                'size': size
+            }
+            self._index_pending_writes += 1
+            self._index_version += 1
+            should_flush = self._index_pending_writes >= INDEX_FLUSH_INTERVAL
+        if should_flush:
+            self.flush_index()
+    
+    def _index_items(self, model_name: Optional[str] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._index_lock:
+            return [(cache_key, entry) for cache_key, entry in self._index.items()
+                    if not model_name or entry['model_name'] == model_name]
+    
+    def _remove_entry(self, cache_key: str):
+        with self._index_lock:
+            if self._index.pop(cache_key, None) is not None:
+                self._index_pending_writes += 1
+                self._index_version += 1
+        with self._memory_cache_lock:
+            self._memory_cache.pop(cache_key, None)
+        try:
+            os.remove(self._get_cache_file_path(cache_key))
+        except FileNotFoundError:
+            pass
+    
+    def _load_index(self):
+        try:
+            self._index = _load_json(self._index_path)
+        except FileNotFoundError:
+            self._index = {}
+        except Exception as e:
+            self.logger.warning(f"緩存索引損壞，將重新建立: {e}")
+            self._index = {}
+        
+        # 與目錄內容對帳：移除已不存在的檔案，只讀取索引中缺少的檔案（例如舊版留下或其他行程寫入的緩存）
+        # os.scandir 一次讀取目錄項目，未索引檔案的大小直接取自 DirEntry，不必逐檔呼叫 getsize
+        with os.scandir(self.cache_dir) as it:
+            cache_entries = {entry.name[:-len('.json')]: entry for entry in it
+                             if entry.name.endswith('.json') and entry.name != INDEX_FILENAME and entry.is_file()}
+        cache_keys = cache_entries.keys()
+        changed = False
+        for cache_key in [cache_key for cache_key in self._index if cache_key not in cache_keys]:
+            del self._index[cache_key]
+            changed = True
+        
+        for cache_key in cache_keys - self._index.keys():
+            cache_data = self._read_cache_file(cache_key)
+            if cache_data is None:
+                self._remove_entry(cache_key)
+                continue
+            self._index[cache_key] = {
+                'model_name': cache_data.get('model_name', 'unknown'),
+                'timestamp': cache_data.get('timestamp'),
+                'parameters': cache_data.get('parameters', {}),
+                'size': cache_entries[cache_key].stat().st_size
+            }
+            changed = True
+        
+        if changed:
+            self._index_pending_writes += 1
+            self.flush_index()
+    
+    def flush_index(self):
+        """將尚未寫入的索引變更寫回磁碟（每 INDEX_FLUSH_INTERVAL 次寫入及程式結束時自動呼叫）"""
+        with self._index_lock:
+            if not self._index_pending_writes:
+                return
+            snapshot = dict(self._index)
+            self._index_pending_writes = 0
+        
+        try:
+            _atomic_write(self._index_path, _dump_json(snapshot))
+        except Exception as e:
+            self.logger.error(f"保存緩存索引失敗: {e}")
+    
     def _is_cache_valid(self, cache_data: Dict) -> bool:
-        if 'timestamp' not in cache_data:
+        if not cache_data.get('timestamp'):
             return False
         
         cache_time = datetime.fromisoformat(cache_data['timestamp'])
@@ -46,25 +284,48 @@ class CacheManager:
             model_name: 模型名稱
             parameters: 測試參數
             
+        Returns:
+            緩存的結果，如果不存在或已過期則返回 None
+        """
+        return self.get_by_key(model_name, make_cache_key(parameters))
+    
+    def get_by_key(self, model_name: str, key: Tuple) -> Optional[Dict]:
+        """
+        Args:
+            model_name: 模型名稱
+            key: 由 make_cache_key 產生的緩存鍵
+            
         Returns:
             緩存的結果，如果不存在或已過期則返回 None
         """
         try:
-            cache_key = self._generate_cache_key(model_name, parameters)
+            cache_key = self._generate_cache_key(model_name, key)
+            result = self._memory_get(cache_key)
+            if result is not None:
+                self.logger.info(f"從緩存獲取結果: {model_name}")
+                return result
+            
             cache_file = self._get_cache_file_path(cache_key)
             
             if not os.path.exists(cache_file):
                 return None
             
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
+            cache_data = _load_json(cache_file)
             
             if not self._is_cache_valid(cache_data):
-                os.remove(cache_file)
+                self._remove_entry(cache_key)
                 return None
             
+            with self._index_lock:
+                indexed = cache_key in self._index
+            if not indexed:
+                self._index_set(cache_key, cache_data, os.path.getsize(cache_file))
+            
             self.logger.info(f"從緩存獲取結果: {model_name}")
-            return cache_data.get('result')
+            result = cache_data.get('result')
+            stored_at = datetime.fromisoformat(cache_data['timestamp']).timestamp()
+            self._memory_set(cache_key, model_name, result, stored_at)
+            return result
             
         except Exception as e:
             self.logger.error(f"讀取緩存失敗: {e}")
@@ -77,80 +338,94 @@ class CacheManager:
             parameters: 測試參數
             result: 測試結果
         """
+        self.set_by_key(model_name, make_cache_key(parameters), result)
+    
+    def set_by_key(self, model_name: str, key: Tuple, result: Dict[str, Any]):
+        """
+        Args:
+            model_name: 模型名稱
+            key: 由 make_cache_key 產生的緩存鍵
+            result: 測試結果
+        """
         try:
-            cache_key = self._generate_cache_key(model_name, parameters)
+            cache_key = self._generate_cache_key(model_name, key)
             cache_file = self._get_cache_file_path(cache_key)
             
+            now = datetime.now()
             cache_data = {
                 'model_name': model_name,
-                'parameters': parameters,
+                'parameters': dict(key),
                 'result': result,
-                'timestamp': datetime.now().isoformat()
+                'timestamp': now.isoformat()
             }
             
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, indent=2, ensure_ascii=False)
+            payload = _dump_json(cache_data, indent=True)
+            _atomic_write(cache_file, payload)
+            self._memory_set(cache_key, model_name, result, now.timestamp())
+            self._index_set(cache_key, cache_data, len(payload))
             
             self.logger.info(f"緩存結果已保存: {model_name}")
             
         except Exception as e:
             self.logger.error(f"保存緩存失敗: {e}")
     
+    def scan(self, model_name: str) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        Args:
+            model_name: 模型名稱
+            
+        Returns:
+            逐一產生該模型所有未過期緩存的 (參數, 結果)
+        """
+        for cache_key, entry in self._index_items(model_name):
+            if not self._is_cache_valid(entry):
+                continue
+            
+            cache_data = self._read_cache_file(cache_key)
+            if cache_data is None:
+                continue
+            
+            yield entry['parameters'], cache_data.get('result')
+    
     def clear(self, model_name: Optional[str] = None):
         """
         Args:
             model_name: 如果指定，只清理該模型的緩存
         """
+        with self._memory_cache_lock:
+            for cache_key in [cache_key for cache_key, (_, cached_model, _) in self._memory_cache.items()
+                              if not model_name or cached_model == model_name]:
+                del self._memory_cache[cache_key]
+        
         try:
-            if not os.path.exists(self.cache_dir):
-                return
-            
-            for filename in os.listdir(self.cache_dir):
-                if not filename.endswith('.json'):
-                    continue
-                
-                file_path = os.path.join(self.cache_dir, filename)
-                
+            for cache_key, _ in self._index_items(model_name):
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        cache_data = json.load(f)
-                    if model_name and cache_data.get('model_name') != model_name:
-                        continue
-                    
-                    os.remove(file_path)
-                    self.logger.info(f"已清理緩存: {filename}")
+                    self._remove_entry(cache_key)
+                    self.logger.info(f"已清理緩存: {cache_key}.json")
                     
                 except Exception as e:
-                    self.logger.error(f"清理緩存檔案失敗 {filename}: {e}")
+                    self.logger.error(f"清理緩存檔案失敗 {cache_key}.json: {e}")
+            
+            self.flush_index()
                     
         except Exception as e:
             self.logger.error(f"清理緩存失敗: {e}")
     
     def _cleanup_expired_cache(self):
         try:
-            if not os.path.exists(self.cache_dir):
-                return
-            
             expired_count = 0
-            for filename in os.listdir(self.cache_dir):
-                if not filename.endswith('.json'):
-                    continue
-                
-                file_path = os.path.join(self.cache_dir, filename)
-                
+            for cache_key, entry in self._index_items():
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        cache_data = json.load(f)
-                    
-                    if not self._is_cache_valid(cache_data):
-                        os.remove(file_path)
-                        expired_count += 1
-                        
+                    expired = not self._is_cache_valid(entry)
                 except Exception:
-                    os.remove(file_path)
+                    expired = True
+            
+                if expired:
+                    self._remove_entry(cache_key)
                     expired_count += 1
             
             if expired_count > 0:
+                self.flush_index()
                 self.logger.info(f"已清理 {expired_count} 個過期緩存檔案")
                 
         except Exception as e:
@@ -158,36 +433,23 @@ class CacheManager:
     
     def get_cache_stats(self) -> Dict[str, Any]:
         try:
-            if not os.path.exists(self.cache_dir):
-                return {'total_files': 0, 'total_size_mb': 0, 'models': {}}
-            
             total_size = 0
             model_stats = {}
+            entries = self._index_items()
             
-            for filename in os.listdir(self.cache_dir):
-                if not filename.endswith('.json'):
-                    continue
-                
-                file_path = os.path.join(self.cache_dir, filename)
-                file_size = os.path.getsize(file_path)
+            for _, entry in entries:
+                file_size = entry.get('size', 0)
                 total_size += file_size
                 
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        cache_data = json.load(f)
-                    
-                    model_name = cache_data.get('model_name', 'unknown')
-                    if model_name not in model_stats:
-                        model_stats[model_name] = {'count': 0, 'size': 0}
+                model_name = entry['model_name']
+                if model_name not in model_stats:
+                    model_stats[model_name] = {'count': 0, 'size': 0}
                     
-                    model_stats[model_name]['count'] += 1
-                    model_stats[model_name]['size'] += file_size
-                    
-                except Exception:
-                    pass
+                model_stats[model_name]['count'] += 1
+                model_stats[model_name]['size'] += file_size
             
             return {
-                'total_files': len([f for f in os.listdir(self.cache_dir) if f.endswith('.json')]),
+                'total_files': len(entries),
                 'total_size_mb': total_size / (1024 * 1024),
                 'models': model_stats
             }
@@ -196,7 +458,7 @@ class CacheManager:
             self.logger.error(f"獲取緩存統計失敗: {e}")
             return {'error': str(e)}
     
-    def get_similar_results(self, model_name: str, parameters: Dict[str, Any], 
+    def get_similar_results(self, model_name: str, parameters: Dict[str, Any],
                           tolerance: float = 0.1) -> List[Dict]:
         """
         Args:
@@ -210,33 +472,32 @@ class CacheManager:
         similar_results = []
         
         try:
-            if not os.path.exists(self.cache_dir):
+            param_keys = tuple(sorted(parameters))
+            cache_keys, params_list, matrix = self._get_param_matrix(model_name, param_keys)
+            if not cache_keys:
                 return similar_results
             
-            for filename in os.listdir(self.cache_dir):
-                if not filename.endswith('.json'):
+            query = np.array([_as_float(parameters[key]) for key in param_keys])
+            numeric = ~np.isnan(query)
+            diff = np.abs(matrix[:, numeric] - query[numeric])
+            thresh = tolerance * np.maximum(np.abs(matrix[:, numeric]), np.abs(query[numeric]))
+            mask = (diff <= thresh).all(axis=1)
+            
+            non_numeric_keys = [key for key, is_numeric in zip(param_keys, numeric) if not is_numeric]
+            for row in np.flatnonzero(mask):
+                cached_params = params_list[row]
+                if any(cached_params[key] != parameters[key] for key in non_numeric_keys):
                     continue
                 
-                file_path = os.path.join(self.cache_dir, filename)
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        cache_data = json.load(f)
-                    
-                    if cache_data.get('model_name') != model_name:
-                        continue
-                    
-                    cached_params = cache_data.get('parameters', {})
-
-                    if self._are_parameters_similar(parameters, cached_params, tolerance):
-                        similar_results.append({
-                            'parameters': cached_params,
-                            'result': cache_data.get('result'),
-                            'timestamp': cache_data.get('timestamp')
-                        })
-                        
-                except Exception:
+                cache_data = self._read_cache_file(cache_keys[row])
+                if cache_data is None:
                     continue
+                
+                similar_results.append({
+                    'parameters': cached_params,
+                    'result': cache_data.get('result'),
+                    'timestamp': cache_data.get('timestamp')
+                })
             
             similar_results.sort(key=lambda x: x['timestamp'], reverse=True)
             
@@ -245,22 +506,36 @@ class CacheManager:
         
         return similar_results
     
-    def _are_parameters_similar(self, params1: Dict, params2: Dict, tolerance: float) -> bool:
-        if set(params1.keys()) != set(params2.keys()):
-            return False
-        
-        for key in params1:
-            val1 = params1[key]
-            val2 = params2[key]
+    def _get_param_matrix(self, model_name: str, param_keys: Tuple[str, ...]) -> Tuple[List[str], List[Dict], np.ndarray]:
+        """
+        Args:
+            model_name: 模型名稱
+            param_keys: 排序後的參數鍵；只有鍵集合完全相同的緩存才可能相似
             
-            if isinstance(val1, (int, float)) and isinstance(val2, (int, float)):
-                if abs(val1 - val2) > tolerance * max(abs(val1), abs(val2)):
-                    return False
-            elif val1 != val2:
-                return False
+        Returns:
+            (緩存鍵列表, 參數列表, 形狀為 (N, d) 的參數矩陣)，索引未變動時直接重用
+        """
+        with self._index_lock:
+            version = self._index_version
+            cached = self._param_matrices.get((model_name, param_keys))
+            if cached is not None and cached[0] == version:
+                return cached[1], cached[2], cached[3]
+            rows = [(cache_key, entry['parameters']) for cache_key, entry in self._index.items()
+                    if entry['model_name'] == model_name and tuple(sorted(entry['parameters'])) == param_keys]
+        
+        cache_keys = [cache_key for cache_key, _ in rows]
+        params_list = [params for _, params in rows]
+        matrix = np.array([[_as_float(params[key]) for key in param_keys] for params in params_list],
+                          dtype=float).reshape(len(rows), len(param_keys))
         
-        return True
+        with self._index_lock:
+            self._param_matrices[(model_name, param_keys)] = (version, cache_keys, params_list, matrix)
+        return cache_keys, params_list, matrix
 cache_manager = CacheManager()
+answer_cache_manager = CacheManager(cache_dir=os.path.join(".cache", "halluc"))
 
 def get_cache_manager() -> CacheManager:
     return cache_manager
+
+def get_answer_cache_manager() -> CacheManager:
+    return answer_cache_manager
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from typing import Iterable, Set
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# 關鍵字達到 4 個起，自動機單次掃描就比逐一子字串搜尋快（未命中時約在 4~5 個關鍵字交會）
+MIN_AUTOMATON_SIZE = 4
+
+class KeywordMatcher:
+    def __init__(self, keywords: Iterable[str], min_automaton_size: int = MIN_AUTOMATON_SIZE,
+                 case_sensitive: bool = False):
+        """
+        Args:
+            keywords: 要搜尋的關鍵字（不區分大小寫時會轉為小寫）
+            min_automaton_size: 關鍵字數量達到此值時改用 Aho-Corasick 自動機
+            case_sensitive: 是否區分大小寫；為 False 時搜尋的文字須已轉為小寫
+        """
+        self.keywords = tuple(dict.fromkeys(keyword if case_sensitive else keyword.lower()
+                                            for keyword in keywords if keyword))
+        self.automaton = None
+        if AHOCORASICK_AVAILABLE and len(self.keywords) >= min_automaton_size:
+            self.automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self.automaton.add_word(keyword, keyword)
+            self.automaton.make_automaton()
+
+    def contains_any(self, text_lower: str) -> bool:
+        """
+        Args:
+            text_lower: 已轉為小寫的文字
+
+        Returns:
+            文字中是否包含任一關鍵字
+        """
+        if self.automaton is not None:
+            return next(self.automaton.iter(text_lower), None) is not None
+        return any(keyword in text_lower for keyword in self.keywords)
+    
+    def find_all(self, text: str) -> Set[str]:
+        """
+        Args:
+            text: 要搜尋的文字（不區分大小寫時須已轉為小寫）
+
+        Returns:
+            文字中出現過的關鍵字集合
+        """
+        if self.automaton is not None:
+            return {keyword for _, keyword in self.automaton.iter(text)}
+        return {keyword for keyword in self.keywords if keyword in text}
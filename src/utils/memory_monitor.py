@@ -1,30 +1,150 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
+import sys
 import psutil
+import numpy as np
 import time
 import threading
+from collections import deque, namedtuple
 from typing import Dict, List, Optional, Callable
 import logging
 
+try:
+    import pynvml
+    NVML_AVAILABLE = True
+except ImportError:
+    NVML_AVAILABLE = False
+
 try:
     import GPUtil
     GPU_AVAILABLE = True
 except ImportError:
     GPU_AVAILABLE = False
-    print("警告：GPUtil 未安裝，GPU 監控功能將不可用")
+    if not NVML_AVAILABLE:
+        print("警告：GPUtil 未安裝，GPU 監控功能將不可用")
+
+# 連續這麼多次取樣都低於警告閾值時，才放寬輪詢間隔
+ADAPTIVE_STABLE_SAMPLES = 10
+# 保留的完整取樣紀錄筆數
+HISTORY_SIZE = 1000
+# GPU 資訊變化緩慢，且 GPUtil 每次查詢都會啟動 nvidia-smi；在此間隔內重複查詢直接回傳上次結果
+GPU_MIN_POLL_INTERVAL = 5.0
+# 等待回調處理的取樣上限；回調處理跟不上時丟棄最舊的取樣
+CALLBACK_QUEUE_SIZE = 64
+
+MemInfo = namedtuple('MemInfo', ['total', 'available', 'used', 'percent', 'free'])
+
+def _read_proc_meminfo(fd: int) -> Optional[MemInfo]:
+    """
+    Linux 快速路徑：/proc/meminfo 的前三行依序為 MemTotal、MemFree、MemAvailable，
+    只解析這三行，計算方式與 psutil.virtual_memory 相同（used = total - available）。
+
+    Args:
+        fd: 已開啟的 /proc/meminfo 檔案描述符
+
+    Returns:
+        記憶體資訊；格式不符預期（例如舊核心沒有 MemAvailable）時返回 None
+    """
+    lines = os.pread(fd, 256, 0).split(b'\n', 3)[:3]
+    if len(lines) < 3:
+        return None
+    fields = {}
+    for line in lines:
+        name, _, value = line.partition(b':')
+        parts = value.split()
+        if not parts:
+            return None
+        fields[name] = int(parts[0]) * 1024
+    if fields.keys() != {b'MemTotal', b'MemFree', b'MemAvailable'}:
+        return None
+    total = fields[b'MemTotal']
+    available = fields[b'MemAvailable']
+    used = total - available
+    percent = round(used / total * 100, 1) if total else 0.0
+    return MemInfo(total, available, used, percent, fields[b'MemFree'])
 
 class MemoryMonitor:
-    def __init__(self, warning_threshold: float = 0.8, critical_threshold: float = 0.95):
+    def __init__(self, warning_threshold: float = 0.8, critical_threshold: float = 0.95,
+                 summary_window: int = 100, gpu_min_interval: float = GPU_MIN_POLL_INTERVAL):
+        """
+        Args:
+            warning_threshold: 記憶體使用率警告閾值
+            critical_threshold: 記憶體使用率危險閾值
+            summary_window: 摘要統計所使用的最近取樣數（環形緩衝區大小）
+            gpu_min_interval: 兩次實際查詢 GPU 資訊之間的最短間隔（秒），期間內重用上次結果
+        """
         self.warning_threshold = warning_threshold
         self.critical_threshold = critical_threshold
         self.monitoring = False
         self.monitor_thread = None
+        self.interval = 1.0
+        self.max_interval = None
+        self._stable_samples = 0
+        self._stop_event = threading.Event()
+        self._subscribers = 0
+        self._subscriber_lock = threading.Lock()
+        self.memory_safe = True
+        self.last_sample_time = 0.0
+        self._virtual_memory_cache = (0.0, None)
+        self._meminfo_fd = None
+        if sys.platform.startswith('linux'):
+            try:
+                self._meminfo_fd = os.open('/proc/meminfo', os.O_RDONLY)
+            except OSError:
+                pass
+        self.gpu_min_interval = gpu_min_interval
+        self._gpu_cache = None
+        self._gpu_cache_ts = 0.0
+        self._gpu_lock = threading.Lock()
         self.callbacks = []
-        self.history = []
+        self._callback_queue = deque(maxlen=CALLBACK_QUEUE_SIZE)
+        self._callback_ready = threading.Condition()
+        self._dispatcher_thread = None
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.summary_window = summary_window
+        self.system_samples = {
+            'percent': np.zeros(summary_window),
+            'used': np.zeros(summary_window),
+            'ts': np.zeros(summary_window)
+        }
+        # 每張 GPU 各自一個環形緩衝區：gpu_id -> {'percent': ndarray, 'count': 已寫入次數, 'sum': 視窗內總和}
+        self.gpu_samples = {}
+        self._system_percent_sum = 0.0
+        self._summary_cache = (0, {})
+        self.sample_count = 0
+        self._nvml_handles = None
+        self._nvml_names = []
         self.logger = logging.getLogger(__name__)
         
+    def _virtual_memory(self):
+        # 同一輪詢週期內多個呼叫端（監控迴圈、安全檢查、可用記憶體查詢）共用同一份快照，
+        # 快取時間為輪詢間隔的一半，避免重複讀取 /proc/meminfo
+        cached_at, memory = self._virtual_memory_cache
+        now = time.monotonic()
+        if memory is None or now - cached_at >= self.interval / 2:
+            memory = self._read_virtual_memory()
+            self._virtual_memory_cache = (now, memory)
+        return memory
+    
+    def _read_virtual_memory(self):
+        if self._meminfo_fd is not None:
+            try:
+                memory = _read_proc_meminfo(self._meminfo_fd)
+                if memory is not None:
+                    return memory
+            except (OSError, ValueError):
+                pass
+            # 格式不符預期時改用 psutil，之後不再嘗試快速路徑
+            fd, self._meminfo_fd = self._meminfo_fd, None
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        return psutil.virtual_memory()
+    
     def get_system_memory_info(self) -> Dict:
-        memory = psutil.virtual_memory()
+        memory = self._virtual_memory()
         return {
             'total': memory.total,
             'available': memory.available,
@@ -33,7 +153,65 @@ class MemoryMonitor:
             'free': memory.free
         }
     
+    def _init_nvml(self) -> bool:
+        """
+        初始化 NVML 並快取每張 GPU 的 handle，整個生命週期只執行一次。
+
+        Returns:
+            NVML 是否可用
+        """
+        if self._nvml_handles is not None:
+            return bool(self._nvml_handles)
+        self._nvml_handles = []
+        if not NVML_AVAILABLE:
+            return False
+        try:
+            pynvml.nvmlInit()
+            for index in range(pynvml.nvmlDeviceGetCount()):
+                handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+                name = pynvml.nvmlDeviceGetName(handle)
+                self._nvml_handles.append(handle)
+                self._nvml_names.append(name.decode() if isinstance(name, bytes) else name)
+        except Exception as e:
+            self.logger.warning(f"NVML 初始化失敗，改用 GPUtil: {e}")
+            self._nvml_handles = []
+        return bool(self._nvml_handles)
+    
+    def _get_nvml_memory_info(self) -> List[Dict]:
+        gpu_info = []
+        for index, handle in enumerate(self._nvml_handles):
+            memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            utilization = pynvml.nvmlDeviceGetUtilizationRates(handle)
+            memory_total = memory.total / (1024**2)
+            memory_used = memory.used / (1024**2)
+            gpu_info.append({
+                'id': index,
+                'name': self._nvml_names[index],
+                'memory_total': memory_total,
+                'memory_used': memory_used,
+                'memory_free': memory.free / (1024**2),
+                'memory_percent': (memory_used / memory_total) * 100 if memory_total else 0,
+                'temperature': pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU),
+                'load': utilization.gpu
+            })
+        return gpu_info
+    
     def get_gpu_memory_info(self) -> List[Dict]:
+        with self._gpu_lock:
+            now = time.monotonic()
+            if self._gpu_cache is None or now - self._gpu_cache_ts >= self.gpu_min_interval:
+                self._gpu_cache = self._query_gpu_memory_info()
+                self._gpu_cache_ts = now
+            return self._gpu_cache
+    
+    def _query_gpu_memory_info(self) -> List[Dict]:
+        if self._init_nvml():
+            try:
+                return self._get_nvml_memory_info()
+            except Exception as e:
+                self.logger.error(f"獲取 GPU 資訊失敗: {e}")
+                return []
+        
         if not GPU_AVAILABLE:
             return []
         
@@ -83,37 +261,149 @@ class MemoryMonitor:
        # 
         return status
     
+    def _update_ring(self, ring: np.ndarray, index: int, value: float, running_sum: float) -> float:
+        """
+        寫入環形緩衝區並以 O(1) 更新視窗內總和；每繞完一圈以 ndarray.sum() 重新校正，避免浮點誤差累積。
+
+        Returns:
+            更新後的視窗內總和
+        """
+        running_sum += value - ring[index]
+        ring[index] = value
+        if index == self.summary_window - 1:
+            running_sum = float(ring.sum())
+        return running_sum
+    
+    def _record_sample(self, status: Dict):
+        index = self.sample_count % self.summary_window
+        self._system_percent_sum = self._update_ring(self.system_samples['percent'], index,
+                                                     status['system_memory']['percent'], self._system_percent_sum)
+        self.system_samples['used'][index] = status['system_memory']['used']
+        self.system_samples['ts'][index] = status['timestamp']
+        self.sample_count += 1
+        for gpu in status['gpu_memory']:
+            samples = self.gpu_samples.get(gpu['id'])
+            if samples is None:
+                samples = self.gpu_samples[gpu['id']] = {'percent': np.zeros(self.summary_window), 'count': 0, 'sum': 0.0}
+            samples['sum'] = self._update_ring(samples['percent'], samples['count'] % self.summary_window,
+                                               gpu['memory_percent'], samples['sum'])
+            samples['count'] += 1
+        percent = status['system_memory']['percent']
+        self.memory_safe = percent <= self.critical_threshold * 100
+        self.last_sample_time = status['timestamp']
+        if percent > self.warning_threshold * 100:
+            self._stable_samples = 0
+        else:
+            self._stable_samples += 1
+    
+    def _next_sleep_interval(self) -> float:
+        """
+        記憶體使用率持續低於警告閾值時逐步拉長輪詢間隔（1 倍 → 5 倍 → 15 倍，上限為 max_interval），
+        減少背景執行緒喚醒次數；一旦超過警告閾值就回到原本的間隔。
+        """
+        if not self.max_interval or self.max_interval <= self.interval:
+            return self.interval
+        if self._stable_samples >= 2 * ADAPTIVE_STABLE_SAMPLES:
+            backoff = 15
+        elif self._stable_samples >= ADAPTIVE_STABLE_SAMPLES:
+            backoff = 5
+        else:
+            backoff = 1
+        return min(self.interval * backoff, self.max_interval)
+
     def add_callback(self, callback: Callable[[Dict], None]):
+        """
+        Args:
+            callback: 每次取樣後呼叫的函數；在獨立的分派執行緒中執行，不會拖慢取樣節奏
+        """
         self.callbacks.append(callback)
+        with self._callback_ready:
+            if self._dispatcher_thread is None:
+                self._dispatcher_thread = threading.Thread(target=self._dispatch_callbacks, daemon=True)
+                self._dispatcher_thread.start()
+    
+    def _dispatch_callbacks(self):
+        while True:
+            with self._callback_ready:
+                while not self._callback_queue:
+                    self._callback_ready.wait()
+                status = self._callback_queue.popleft()
+            for callback in list(self.callbacks):
+                try:
+                    callback(status)
+                except Exception as e:
+                    self.logger.error(f"回調函數執行失敗: {e}")
     
-    def start_monitoring(self, interval: float = 1.0):
+    def set_interval(self, interval: float) -> float:
+        """
+        Args:
+            interval: 新的輪詢間隔（秒），於下一次取樣後生效
+
+        Returns:
+            原本的輪詢間隔，方便呼叫端稍後還原
+        """
+        previous = self.interval
+        self.interval = interval
+        return previous
+    
+    def start_monitoring(self, interval: float = 1.0, max_interval: Optional[float] = None):
+        """
+        Args:
+            interval: 輪詢間隔（秒）
+            max_interval: 記憶體穩定時可放寬到的最長輪詢間隔；None 表示固定間隔
+        """
         if self.monitoring:
             return
         
         self.monitoring = True
-        self.monitor_thread = threading.Thread(target=self._monitor_loop, args=(interval,))
+        self.interval = interval
+        self.max_interval = max_interval
+        self._stable_samples = 0
+        self._stop_event.clear()
+        self.monitor_thread = threading.Thread(target=self._monitor_loop)
         self.monitor_thread.daemon = True
         self.monitor_thread.start()
         self.logger.info("記憶體監控已啟動")
     
+    def acquire(self, interval: float = 1.0, max_interval: Optional[float] = None):
+        """
+        登記一個使用者；第一個使用者出現時才啟動監控，沒有人讀取時不必在背景取樣。
+
+        Args:
+            interval: 輪詢間隔（秒），僅在本次呼叫啟動監控時生效
+            max_interval: 記憶體穩定時可放寬到的最長輪詢間隔；None 表示固定間隔
+        """
+        with self._subscriber_lock:
+            self._subscribers += 1
+            if self._subscribers == 1:
+                self.start_monitoring(interval=interval, max_interval=max_interval)
+    
+    def release(self):
+        """取消一個 acquire() 的登記；最後一個使用者離開時停止監控。"""
+        with self._subscriber_lock:
+            if self._subscribers == 0:
+                return
+            self._subscribers -= 1
+            if self._subscribers == 0:
+                self.stop_monitoring()
+    
     def stop_monitoring(self):
         self.monitoring = False
+        self._stop_event.set()
         if self.monitor_thread:
             self.monitor_thread.join()
         self.logger.info("記憶體監控已停止")
     
-    def _monitor_loop(self, interval: float):
+    def _monitor_loop(self):
         while self.monitoring:
             try:
                 status = self.get_memory_status()
                 self.history.append(status)
-                if len(self.history) > 1000:
-                    self.history = self.history[-500:]
-                for callback in self.callbacks:
-                    try:
-                        callback(status)
-                    except Exception as e:
-                        self.logger.error(f"回調函數執行失敗: {e}")
+                self._record_sample(status)
+                if self.callbacks:
+                    with self._callback_ready:
+                        self._callback_queue.append(status)
+                        self._callback_ready.notify()
                 if status['warnings']:
                     for warning in status['warnings']:
                         if status['critical']:
@@ -121,26 +411,36 @@ class MemoryMonitor:
                         else:
                             self.logger.warning(warning)
                 
-                time.sleep(interval)
+                # stop_monitoring() 設定事件後立即結束，不再多做一次取樣
+                if self._stop_event.wait(self._next_sleep_interval()):
+                    break
                 
             except Exception as e:
                 self.logger.error(f"監控循環錯誤: {e}")
-                time.sleep(interval)
+                if self._stop_event.wait(self.interval):
+                    break
     
     def get_memory_summary(self) -> Dict:
+        """
+        Returns:
+            最近 summary_window 次取樣的摘要；沒有新取樣時直接回傳上次建立的結果
+        """
+        sample_count = self.sample_count
+        cached_count, cached_summary = self._summary_cache
+        if cached_count == sample_count:
+            return cached_summary
         if not self.history:
             return {}
         
-        recent_history = self.history[-100:]
-        
-        system_memory_avg = sum(h['system_memory']['percent'] for h in recent_history) / len(recent_history)
-        system_memory_max = max(h['system_memory']['percent'] for h in recent_history)
+        n_samples = min(sample_count, self.summary_window)
+        system_percent = self.system_samples['percent'][:n_samples]
+        current_index = (self.sample_count - 1) % self.summary_window
         
         summary = {
             'system_memory': {
-                'average_percent': system_memory_avg,
-                'max_percent': system_memory_max,
-                'current_percent': self.history[-1]['system_memory']['percent']
+                'average_percent': self._system_percent_sum / n_samples,
+                'max_percent': float(system_percent.max()),
+                'current_percent': float(self.system_samples['percent'][current_index])
             },
             'gpu_memory': {}
         }
@@ -148,19 +448,18 @@ class MemoryMonitor:
         if self.history[-1]['gpu_memory']:
             for gpu in self.history[-1]['gpu_memory']:
                 gpu_id = gpu['id']
-                gpu_percentages = [h['gpu_memory'][i]['memory_percent'] 
-                                 for h in recent_history 
-                                 for i, g in enumerate(h['gpu_memory']) 
-                                 if g['id'] == gpu_id]
+                samples = self.gpu_samples.get(gpu_id)
                 
-                if gpu_percentages:
+                if samples and samples['count']:
+                    gpu_percentages = samples['percent'][:min(samples['count'], self.summary_window)]
                     summary['gpu_memory'][gpu_id] = {
                         'name': gpu['name'],
-                        'average_percent': sum(gpu_percentages) / len(gpu_percentages),
-                        'max_percent': max(gpu_percentages),
+                        'average_percent': samples['sum'] / len(gpu_percentages),
+                        'max_percent': float(gpu_percentages.max()),
                         'current_percent': gpu['memory_percent']
                     }
         
+        self._summary_cache = (sample_count, summary)
         return summary
     
     def is_memory_safe(self) -> bool:
@@ -170,6 +469,21 @@ class MemoryMonitor:
             return False
         return True
     
+    def is_memory_safe_cached(self) -> bool:
+        """
+        讀取背景監控最近一次取樣的結果，不重新呼叫 psutil；
+        監控未啟動或取樣已過期（超過兩個基本輪詢間隔）時改為即時檢查。
+        """
+        # 以目前生效的基本間隔判斷，而非放寬後的 max_interval：間隔只在記憶體平穩時拉長，
+        # 正是探測突然配置大量記憶體時最容易過期的情況
+        max_age = 2 * self.interval
+        if not self.monitoring or time.time() - self.last_sample_time > max_age:
+            return self.is_memory_safe()
+        if not self.memory_safe:
+            current_index = (self.sample_count - 1) % self.summary_window
+            self.logger.critical(f"系統記憶體使用率過高: {self.system_samples['percent'][current_index]:.1f}%，暫停以策安全。")
+        return self.memory_safe
+    
     def get_available_memory(self) -> Dict:
         system_memory = self.get_system_memory_info()
         gpu_memory = self.get_gpu_memory_info()
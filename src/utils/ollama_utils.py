@@ -1,20 +1,52 @@
 import re
+import time
 import ollama
 import logging
+import threading
+from functools import lru_cache
+from typing import Optional
+
+_SIZE_NUMBER_PATTERN = re.compile(r"(\d+\.?\d*)")
+_NAME_SIZE_PATTERN = re.compile(r"(\d+)b")
+
+# 本地模型列表在一次調校期間幾乎不變，短時間內重複查詢直接使用快取
+LOCAL_MODELS_CACHE_TTL = 5.0
+_local_models_cache = (0.0, None)
+_local_models_lock = threading.Lock()
+
+# 共用同一個 ollama.Client，讓所有請求重用 httpx 的連線池 (HTTP keep-alive)
+ollama_client = ollama.Client()
+
+@lru_cache(maxsize=None)
+def _get_timeout_client(timeout: float) -> ollama.Client:
+    return ollama.Client(timeout=timeout)
+
+def get_ollama_client(timeout: Optional[float] = None) -> ollama.Client:
+    """
+    Args:
+        timeout: 連線與讀取逾時秒數；None 表示不設限
+
+    Returns:
+        共用的 ollama.Client，相同逾時設定的請求共用同一個連線池
+    """
+    if timeout is None:
+        return ollama_client
+    return _get_timeout_client(float(timeout))
 
 def get_model_size_in_billions(model_details: dict) -> float:
     try:
         size_str = model_details.get('parameter_size', '').upper()
-        if 'B' in size_str:
-            return float(re.findall(r"(\d+\.?\d*)", size_str)[0])
-        elif 'M' in size_str:
-            return float(re.findall(r"(\d+\.?\d*)", size_str)[0]) / 1000.0
-    except (IndexError, ValueError):
+        number = _SIZE_NUMBER_PATTERN.search(size_str)
+        if number and 'B' in size_str:
+            return float(number.group(1))
+        elif number and 'M' in size_str:
+            return float(number.group(1)) / 1000.0
+    except ValueError:
         pass
     
     model_name = model_details.get('model', '')
     model_name = model_name.lower()
-    match = re.search(r'(\d+)b', model_name)
+    match = _NAME_SIZE_PATTERN.search(model_name)
     if match:
         try:
             return float(match.group(1))
@@ -25,10 +57,30 @@ def get_model_size_in_billions(model_details: dict) -> float:
     return 0.0
     
 def get_local_ollama_models() -> list[dict]:
+    """
+    Returns:
+        本地模型列表；LOCAL_MODELS_CACHE_TTL 秒內重複呼叫不會再向 Ollama 服務查詢
+    """
+    global _local_models_cache
+    with _local_models_lock:
+        fetched_at, models = _local_models_cache
+        if models is None or time.monotonic() - fetched_at > LOCAL_MODELS_CACHE_TTL:
+            models = _fetch_local_ollama_models()
+            # 查詢失敗或沒有模型時不快取，下次呼叫會重新查詢
+            _local_models_cache = (time.monotonic(), models) if models else (0.0, None)
+    return list(models)
+
+def clear_local_models_cache():
+    """需要立即反映新拉取或刪除的模型時呼叫，下一次 get_local_ollama_models() 會重新查詢。"""
+    global _local_models_cache
+    with _local_models_lock:
+        _local_models_cache = (0.0, None)
+
+def _fetch_local_ollama_models() -> list[dict]:
     logger = logging.getLogger(__name__)
     logger.info("Attempting to fetch local models from Ollama service...")
     try:
-        response = ollama.list()
+        response = get_ollama_client().list()
         logger.info(f"Received response from ollama.list(): {response}")
         
         models = response.get('models', [])
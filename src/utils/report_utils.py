@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+from functools import lru_cache
+
+REPORT_TEMPLATE_NAME = 'enhanced_report_template.html'
+# Jinja 編譯後的位元組碼快取目錄，下次啟動時不必重新解析模板
+JINJA_BYTECODE_CACHE_DIR = '.jinja_cache'
+
+@lru_cache(maxsize=None)
+def get_report_template(name: str = REPORT_TEMPLATE_NAME):
+    """
+    Args:
+        name: 模板檔名（相對於目前工作目錄）
+
+    Returns:
+        已編譯的 Jinja 模板；同一行程內只讀取並解析一次
+    """
+    from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+    os.makedirs(JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+    env = Environment(loader=FileSystemLoader('.'), auto_reload=False, cache_size=-1,
+                      bytecode_cache=FileSystemBytecodeCache(JINJA_BYTECODE_CACHE_DIR))
+    return env.get_template(name)
@@ -6,6 +6,7 @@ import logging
 import time
 import threading
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, Any, List
 import numpy as np
@@ -17,6 +18,7 @@ from src.core.enhanced_tuner import EnhancedOllamaTuner
 from src.utils.memory_monitor import get_memory_monitor
 from src.utils.cache_manager import get_cache_manager
 from src.ui.web_interface import get_web_ui
+from src.utils.report_utils import get_report_template
 
 logging.basicConfig(
     level=logging.INFO,
@@ -29,12 +31,8 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-def convert_numpy_types(obj):
-    if isinstance(obj, dict):
-        return {k: convert_numpy_types(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_numpy_types(i) for i in obj]
-    elif isinstance(obj, np.integer):
+def _convert_numpy_value(obj):
+    if isinstance(obj, np.integer):
         return int(obj)
     elif isinstance(obj, np.floating):
         return float(obj)
@@ -44,25 +42,93 @@ def convert_numpy_types(obj):
         return bool(obj)
     return obj
 
+def convert_numpy_types(obj):
+    """
+    以顯式堆疊走訪巢狀的 dict / list，就地把 NumPy 數值換成 Python 原生型別；
+    不含 NumPy 值的容器不會被複製。
+
+    Args:
+        obj: 要轉換的資料（會被就地修改）
+
+    Returns:
+        轉換後的資料，容器為傳入的同一個物件
+    """
+    if not isinstance(obj, (dict, list)):
+        return _convert_numpy_value(obj)
+    
+    stack = [obj]
+    while stack:
+        container = stack.pop()
+        items = container.items() if isinstance(container, dict) else enumerate(container)
+        for key, value in items:
+            if isinstance(value, (dict, list)):
+                stack.append(value)
+            elif isinstance(value, (np.generic, np.ndarray)):
+                container[key] = _convert_numpy_value(value)
+    return obj
+
+# 記憶體使用率（百分點）變化超過此值才推送到 Web UI
+MEMORY_UPDATE_THRESHOLD = 1.0
+
+def has_significant_change(old, new, threshold: float) -> bool:
+    """
+    Args:
+        old: 上次推送的資料
+        new: 目前的資料
+        threshold: 數值欄位的變化門檻；非數值欄位或結構不同時一律視為有變化
+
+    Returns:
+        是否需要重新推送
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        return old.keys() != new.keys() or any(
+            has_significant_change(old[key], new[key], threshold) for key in new)
+    if isinstance(old, (int, float)) and isinstance(new, (int, float)) \
+            and not isinstance(old, bool) and not isinstance(new, bool):
+        return abs(new - old) > threshold
+    return old != new
+
 class WebIntegratedTuner:
     def __init__(self, host='0.0.0.0', port=5000):
         self.host = host
         self.port = port
         self.web_ui = get_web_ui()
-        self.tuning_thread = None
+        # 調校工作交給常駐的工作執行緒，反覆從 Web UI 開始／停止時不必每次建立新執行緒；
+        # Web UI 與監控迴圈會執行到程式結束，仍使用各自的 daemon 執行緒
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tuner')
+        self._tuning_future = None
         self.is_tuning = False
         self.stop_event = threading.Event()
+        self._shutdown = threading.Event()
         self.all_results = []
         
         self.memory_monitor = get_memory_monitor()
         self.cache_manager = get_cache_manager()
         
-        self.memory_monitor.start_monitoring(interval=2.0)
+        # 有瀏覽器連線時才取樣記憶體；無人觀看時不佔用 CPU
+        self._client_refs = 0
+        self._client_lock = threading.Lock()
+        self.web_ui.add_client_listener(self._on_client_change)
         
         self.web_ui.socketio.on('start_tuning')(self.start_tuning_from_web)
         self.web_ui.socketio.on('stop_tuning')(self.stop_tuning_from_web)
         self.web_ui.socketio.on('generate_report')(self.generate_report_from_web)
 
+    def _on_client_change(self, connected: bool):
+        with self._client_lock:
+            if connected:
+                self._client_refs += 1
+                self.memory_monitor.acquire(interval=2.0)
+            elif self._client_refs:
+                self._client_refs -= 1
+                self.memory_monitor.release()
+
+    def _release_clients(self):
+        with self._client_lock:
+            while self._client_refs:
+                self._client_refs -= 1
+                self.memory_monitor.release()
+
     def start_web_ui(self):
         web_thread = threading.Thread(target=lambda: self.web_ui.run(host=self.host, port=self.port), daemon=True)
         web_thread.start()
@@ -70,16 +136,24 @@ class WebIntegratedTuner:
 
     def start_monitoring_thread(self):
         def monitor():
-            while True:
+            last_memory_data = None
+            last_cache_data = None
+            while not self._shutdown.is_set():
                 try:
+                    # 只在數值確實變動時推送，系統閒置時不必每 2 秒重新序列化並送出相同內容
                     memory_data = self.memory_monitor.get_memory_summary()
-                    self.web_ui.update_memory_usage(memory_data)
+                    if last_memory_data is None or has_significant_change(last_memory_data, memory_data,
+                                                                            MEMORY_UPDATE_THRESHOLD):
+                        self.web_ui.update_memory_usage(memory_data)
+                        last_memory_data = memory_data
                     cache_data = self.cache_manager.get_cache_stats()
-                    self.web_ui.update_cache_stats(cache_data)
-                    time.sleep(2)
+                    if cache_data != last_cache_data:
+                        self.web_ui.update_cache_stats(cache_data)
+                        last_cache_data = cache_data
+                    self._shutdown.wait(2)
                 except Exception as e:
                     logger.error(f"監控線程錯誤: {e}", exc_info=True)
-                    time.sleep(5)
+                    self._shutdown.wait(5)
         monitor_thread = threading.Thread(target=monitor, daemon=True)
         monitor_thread.start()
 
@@ -88,20 +162,18 @@ class WebIntegratedTuner:
         report_filename = self.generate_enhanced_html_report()
         if report_filename:
             self.web_ui.add_log_message('info', f"報告已生成: {report_filename}")
-            self.web_ui.socketio.emit('report_generated', {'filename': report_filename})
+            self.web_ui.emit_event('report_generated', {'filename': report_filename})
         else:
             self.web_ui.add_log_message('error', "報告生成失敗")
 
     def generate_enhanced_html_report(self):
-        from jinja2 import Environment, FileSystemLoader
         report_filename = 'enhanced_ollama_tuner_report.html'
         try:
             if not self.all_results:
                 self.web_ui.add_log_message('warning', "沒有結果可供生成報告。")
                 return None
             
-            env = Environment(loader=FileSystemLoader('.'))
-            template = env.get_template('enhanced_report_template.html')
+            template = get_report_template()
             
             report_data = {
                 'results': self.all_results,
@@ -109,9 +181,8 @@ class WebIntegratedTuner:
                 'memory_summary': self.memory_monitor.get_memory_summary(),
                 'cache_stats': self.cache_manager.get_cache_stats()
             }
-            html_content = template.render(report_data)
             with open(report_filename, 'w', encoding='utf-8') as f:
-                f.write(html_content)
+                template.stream(report_data).dump(f)
             return report_filename
         except Exception as e:
             logger.error(f"生成 HTML 報告時發生錯誤: {e}", exc_info=True)
@@ -128,12 +199,15 @@ class WebIntegratedTuner:
 
     def start_tuning_from_web(self, data):
         if self.is_tuning: return self.web_ui.add_log_message('warning', '調校已在運行中')
+        # 按下停止後 is_tuning 立即變為 False，但上一輪可能仍在 tuner.run() 中收尾；
+        # 此時清除 stop_event 會讓它繼續執行，必須等它結束才能開始新的調校
+        if self._tuning_future is not None and not self._tuning_future.done():
+            return self.web_ui.add_log_message('warning', '上一次調校仍在停止中，請稍候再試')
         self.all_results = []
         self.stop_event.clear()
         model_to_run = data.get('model_name') if data and data.get('model_name') else None
         self.is_tuning = True
-        self.tuning_thread = threading.Thread(target=self.run_tuning_logic, args=(model_to_run,), daemon=True)
-        self.tuning_thread.start()
+        self._tuning_future = self._pool.submit(self.run_tuning_logic, model_to_run)
 
     def stop_tuning_from_web(self):
         if self.is_tuning:
@@ -204,12 +278,17 @@ class WebIntegratedTuner:
             self.web_ui.add_log_message('error', "無法獲取本地模型列表，請檢查 Ollama 服務。")
 
         try:
-            while True:
-                time.sleep(1)
+            # POSIX 上阻塞中的 Event.wait() 可被 Ctrl+C 中斷；Windows 的鎖等待無法中斷，仍以短逾時分段等待
+            timeout = 1.0 if os.name == 'nt' else None
+            while not self._shutdown.wait(timeout):
+                pass
         except KeyboardInterrupt:
+            self._shutdown.set()
+            self.stop_event.set()
+            self._pool.shutdown(wait=False, cancel_futures=True)
             logger.info("接收到中斷信號，正在關閉...")
-            if self.memory_monitor:
-                self.memory_monitor.stop_monitoring()
+            # 只釋放 Web UI 連線持有的計數，仍在執行的調校會自行 release()
+            self._release_clients()
             logger.info("程式執行完成")
 
 def main():